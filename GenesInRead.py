@@ -1,145 +1,568 @@
 #! /usr/bin/env python
 import sys
-import gzip
+import zlib
+import bz2
+import lzma
+import itertools
+import hashlib
+import mmap
+import struct
+import multiprocessing
+import json
+import time
+import resource
+import tracemalloc
+import cProfile
+import pstats
+import math
+import os
+import stat
+import socket
+import socketserver
+import signal
+import threading
+import queue
+from array import array
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
 
-def argument_parser(argv, kmer_length, gene_file, read_file):
+# numpy is only needed for the --numpy depht counts
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def argument_parser(argv, options, flags=(), aliases={}, multi=(), positional=None):
     """
     Sets up a argument parser from the argv vector. 
-    In addition takes in default values for variables, if not given 
-    arguments in argv
+    options is a dict with the default value of each argument (eg {"-k": 19}),
+    which is replaced by the argument given in argv. The type of the default
+    value is used for the given argument (str if the default is None).
+    The arguments in flags takes no value and are True if given in argv.
+    aliases maps other names of an argument to its name in options (eg {"--threads": "-t"}).
+    The arguments in multi takes one or more values (eg -r a.gz b.gz) and are lists of str.
+    A single "-" is a value (eg -r - for stdin), not an argument.
+    If positional is given, the values not belonging to an argument are a list of str under that name.
+    Returns a dict with the value of each argument and flag.
     """
+    options = dict(options)
+    for flag in flags:
+        options[flag] = False
+    for name in multi:
+        options[name] = [] if options[name] is None else [options[name]]
+    if positional is not None:
+        options[positional] = []
+
     last_arg = ""
+    # The multi argument taking values, and the multi arguments given in argv
+    collecting = None
+    given = set()
     # Go throug argv. If the last argument was a "-" argument (eg -k), save the argument in correct variable
+    def is_argument(arg):
+        return arg.startswith("-") and arg != "-"
+
     for arg in argv:
-        # Exit if missing an argument
-        if last_arg.startswith("-") and arg.startswith("-"):
+        if is_argument(arg):
+            collecting = None
+
+        # Exit if missing an argument, a flag is not the value of the argument before it
+        if is_argument(last_arg) and is_argument(arg):
             sys.exit(f"Missing argument in {last_arg}")
-        elif arg.startswith("-") and argv[-1] == arg:
+
+        # Flags does not take an argument
+        elif arg in flags:
+            options[arg] = True
+            arg = ""
+
+        elif is_argument(arg) and argv[-1] == arg:
             sys.exit(f"Missing argument in {arg}")
 
-        elif last_arg == "-k":
-            try:
-                kmer_length = int(arg)
-            except ValueError as e:
-                sys.exit(f"The kmer needs to be an integer, error:\n{e}")
+        elif aliases.get(last_arg, last_arg) in options:
+            name = aliases.get(last_arg, last_arg)
+            if name in multi:
+                # The values given in argv replaces the default
+                if name not in given:
+                    options[name] = []
+                    given.add(name)
+                options[name].append(arg)
+                collecting = name
+            elif isinstance(options[name], int):
+                try:
+                    options[name] = int(arg)
+                except ValueError as e:
+                    sys.exit(f"The argument in {last_arg} needs to be an integer, error:\n{e}")
+            elif isinstance(options[name], float):
+                try:
+                    options[name] = float(arg)
+                except ValueError as e:
+                    sys.exit(f"The argument in {last_arg} needs to be a number, error:\n{e}")
+            else:
+                options[name] = arg
 
-        elif last_arg == "-g":
-            gene_file = arg
+        # More values of a multi argument
+        elif collecting is not None:
+            options[collecting].append(arg)
 
-        elif last_arg == "-r":
-            read_file = arg
+        elif positional is not None and not is_argument(arg):
+            options[positional].append(arg)
 
         last_arg = arg
 
-    return (kmer_length, gene_file, read_file)
+    return options
 
-def read_fasta(filename):
+def read_fasta(filename, as_bytes=False, mapped=False):
     '''Reading in several fasta files
-       yield each pair of header and dna seperate
+       yield each pair of header and dna seperate.
+       The dna is a str, or bytes if as_bytes. With mapped the dna on one line in a regular file which is
+       not compressed is a memoryview of the memory mapped file, else bytes.
+       The file can be gzip, bgzip, bz2 or xz compressed or not, which is found from the first bytes.
     '''
     # Try to open the file, error if file does not exsist
-    try: file = open(filename, "r")
+    try: file = open(filename, "rb")
     except FileNotFoundError as errormessage:
         sys.exit(f"The file '{filename}' could not be found, error: {errormessage}")
 
-    # Extract the dna, and the headers.
-    oldheader = "FIRST HEADER"
-    for line in file:
-        line = line.strip()
-        #if line is header yield dna and header except FIRST HEADER
-        if line.startswith(">"):    
-            newheader = line
-            if oldheader != "FIRST HEADER":
-                yield dna, oldheader
-            dna = ""
-            oldheader = newheader
+    # Extract the dna, and the headers. A regular file which is not compressed is memory mapped and parsed
+    # at once, a compressed file or a pipe is read in blocks and parsed a few records at a time.
+    with file:
+        first_block = file.read(COMPRESSED_BLOCK_SIZE)
+        compression = sniff_format(first_block)
+        if compression == "plain" and not first_block:
+            return
+        is_mapped = compression == "plain" and is_regular_file(file)
+        if is_mapped:
+            file_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            # The memoryviews of the dna keep the map open, it is closed when they are all gone
+            records = fasta_records(file_map, memoryview(file_map) if mapped else None)
         else:
-            dna += line
-    # Yield the last header and dna
-    yield dna, oldheader
-    file.close()
-    
-def read_fastq(filename):
-    '''Extract dna from a gzipped fastQ file '''
+            blocks = itertools.chain([first_block], iter(lambda: file.read(COMPRESSED_BLOCK_SIZE), b""))
+            if compression != "plain":
+                blocks = decompressed_blocks(blocks, NEW_DECOMPRESSOR[compression], filename)
+            records = (record for chunk in fasta_chunks(blocks) for record in fasta_records(chunk))
+        for header, dna in records:
+            yield (dna if as_bytes or mapped else dna.decode()), header
+        if is_mapped and not mapped:
+            file_map.close()
+
+def fasta_chunks(blocks):
+    '''Yield chunks of whole fasta records from the blocks of a fasta file.
+       The blocks of a record are joined once, so a long record is not copied again for each block.
+    '''
+    carry = []   # The blocks of the last record, which may continue in the next block
+    for block in blocks:
+        # A record starts after the last newline followed by ">"
+        cut = block.rfind(b"\n>") + 1
+        if cut == 0 and not (block.startswith(b">") and carry and carry[-1].endswith(b"\n")):
+            carry.append(block)
+            continue
+        carry.append(block[:cut])
+        yield b"".join(carry)
+        carry = [block[cut:]]
+    yield b"".join(carry)
+
+def fasta_records(buffer, view=None):
+    '''Yield the header (as str, with the ">") and dna (as bytes) of each fasta record in the buffer
+       (bytes or mmap). If a view of the buffer is given, dna on one line is a slice of the view.
+    '''
+    end = len(buffer)
+    start = buffer.find(b">")
+    while start >= 0:
+        header_end = buffer.find(b"\n", start)
+        if header_end < 0:
+            header_end = end
+        header = buffer[start: header_end].strip().decode()
+        next_start = buffer.find(b"\n>", header_end)
+        dna_end = end if next_start < 0 else next_start
+        # Skip the whitespace at the end of the dna
+        while dna_end > header_end and buffer[dna_end - 1] in b" \t\r\n":
+            dna_end -= 1
+        dna_start = min(header_end + 1, dna_end)
+        if view is not None and buffer.find(b"\n", dna_start, dna_end) < 0 and buffer.find(b"\r", dna_start, dna_end) < 0:
+            dna = view[dna_start: dna_end]
+        else:
+            # The lines of the dna are joined in one pass, deleting the whitespace
+            dna = buffer[dna_start: dna_end].translate(None, b" \t\r\n")
+        yield header, dna
+        start = next_start + 1 if next_start >= 0 else -1
+
+# The number of bytes read from the decompressed fastq file at a time
+FASTQ_BLOCK_SIZE = 1 << 22
+COMPRESSED_BLOCK_SIZE = 1 << 20
+
+def sniff_format(head):
+    '''Return the compression of a file from its first bytes: "gzip", "bgzip", "bz2", "xz" or "plain"'''
+    if head.startswith(b"\x1f\x8b"):
+        # bgzip is gzip with the "BC" extra field in each member
+        if len(head) >= 14 and head[3] & 4 and head[12:14] == b"BC":
+            return "bgzip"
+        return "gzip"
+    if head.startswith(b"BZh"):
+        return "bz2"
+    if head.startswith(b"\xfd7zXZ\x00"):
+        return "xz"
+    return "plain"
+
+def is_regular_file(file):
+    '''Return True if the open file is a regular file, which can be memory mapped (not a pipe or a device)'''
+    return stat.S_ISREG(os.fstat(file.fileno()).st_mode)
+
+def decompressed_blocks(raw_blocks, new_decompressor, filename):
+    '''Decompress the blocks of a compressed file, yield the decompressed blocks.
+       A new decompressor is made for each member (stream) of the file, as in bgzip
+       or concatenated files.
+    '''
+    decompressor = new_decompressor()
+    for raw_block in raw_blocks:
+        while raw_block:
+            if decompressor.eof:
+                decompressor = new_decompressor()
+            block = decompressor.decompress(raw_block)
+            if block:
+                yield block
+            raw_block = decompressor.unused_data if decompressor.eof else b""
+    if not decompressor.eof:
+        sys.exit(f"The file '{filename}' ended before the end of the compressed data")
+
+# The decompressor of each compressed format, the wbits of zlib reads gzip headers
+NEW_DECOMPRESSOR = {"gzip": lambda: zlib.decompressobj(wbits=31),
+                    "bgzip": lambda: zlib.decompressobj(wbits=31),
+                    "bz2": bz2.BZ2Decompressor,
+                    "xz": lzma.LZMADecompressor}
+
+def mapped_blocks(mapped):
+    '''Yield blocks of whole lines of a memory mapped file'''
+    start = 0
+    while start < len(mapped):
+        end = mapped.rfind(b"\n", start, start + FASTQ_BLOCK_SIZE) + 1
+        if end <= start or start + FASTQ_BLOCK_SIZE >= len(mapped):
+            end = min(len(mapped), start + FASTQ_BLOCK_SIZE)
+        yield mapped[start:end]
+        start = end
+
+def read_fastq_batches(filename, fileobj=None):
+    '''Extract dna from a file with reads, or from the stream fileobj if given (then filename
+       is only used in error messages), yield a list with the dna (as bytes) of the reads in each block.
+       The filename "-" reads from stdin.
+       The reads can be fastq or fasta, gzip, bgzip, bz2 or xz compressed or not, which is found
+       from the first bytes. A regular file which is not compressed is memory mapped, a pipe is read in blocks.
+    '''
+    # Read stdin in large blocks, it is never seeked
+    if filename == "-" and fileobj is None:
+        fileobj = sys.stdin.buffer
+
     # Try to open the file, error if file does not exsist
-    try: sample_file = gzip.open(filename, "r")
-    except FileNotFoundError as errormessage:
-        sys.exit(f"The file '{filename}' could not be found, error: {errormessage}")
+    if fileobj is None:
+        try: sample_file = open(filename, "rb")
+        except FileNotFoundError as errormessage:
+            sys.exit(f"The file '{filename}' could not be found, error: {errormessage}")
+    else:
+        sample_file = fileobj
 
-    last_line = ""
-    try:
-        for line in sample_file:
-            line = line.decode("utf-8")
-
-            # Extracting the dna
-            if last_line.startswith("@"):
-                dna = line.strip()
-                yield dna
-
-            last_line = line
-    
-    # Error message if the gzipped file does not work
-    except gzip.BadGzipFile as errormessage:
-        sys.exit(f"The file '{filename}' could not be gzipped, error: {errormessage}")
-    sample_file.close()
-
-def get_kmers_and_pos(dna, kmer_len):
-    '''Find Kmers from a dna string and return list with them
-       in additon to list with their positions in the dna string
+    # A stream given as fileobj is not closed here
+    with sample_file if fileobj is None else nullcontext():
+        first_block = sample_file.read(COMPRESSED_BLOCK_SIZE)
+        compression = sniff_format(first_block)
+        if compression == "plain" and fileobj is None and first_block and is_regular_file(sample_file):
+            with mmap.mmap(sample_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield from parse_read_blocks(mapped_blocks(mapped), filename)
+            return
+        raw_blocks = iter(lambda: sample_file.read(COMPRESSED_BLOCK_SIZE), b"")
+        blocks = itertools.chain([first_block], raw_blocks)
+        if compression != "plain":
+            blocks = decompressed_blocks(blocks, NEW_DECOMPRESSOR[compression], filename)
+        try:
+            yield from parse_read_blocks(blocks, filename)
+        # Error message if the compressed file does not work
+        except (zlib.error, OSError, EOFError, lzma.LZMAError) as errormessage:
+            sys.exit(f"The file '{filename}' could not be decompressed ({compression}), error: {errormessage}")
+
+def parse_read_blocks(blocks, filename):
+    '''Parse the blocks of a file with reads, as fastq if it starts with "@" or fasta if it starts with ">"'''
+    blocks = iter(blocks)
+    first_block = next(blocks, b"")
+    first = first_block.lstrip()[:1]
+    blocks = itertools.chain([first_block], blocks)
+    if first == b">":
+        return parse_fasta_blocks(blocks)
+    if first and first != b"@":
+        sys.exit(f"The file '{filename}' is not in fastq or fasta format")
+    return parse_fastq_blocks(blocks, filename)
+
+def parse_fastq_blocks(blocks, filename):
+    '''Parse the blocks of a fastq file, the records are taken as groups of 4 lines.
+       Yield a list with the dna (as bytes) of the reads in each block.
+       Only the dna lines are extracted, the other lines are never decoded.
+    '''
+    rest = b""   # The unfinished last line of the previous block
+    line_in_record = 0   # The line number in its record of the first line in the block
+    for block in blocks:
+        data = rest + block
+        lines = data.split(b"\n")
+        rest = lines.pop()
+
+        # The header line of the first record in the block must start with "@"
+        first_header = -line_in_record % 4
+        if first_header < len(lines) and not lines[first_header].startswith(b"@"):
+            sys.exit(f"The file '{filename}' is not in fastq format")
+
+        # Extracting the dna, which is the second line of each record
+        dna_reads = lines[(1 - line_in_record) % 4::4]
+        if b"\r" in data:
+            dna_reads = [dna.strip() for dna in dna_reads]
+        if dna_reads:
+            yield dna_reads
+        line_in_record = (line_in_record + len(lines)) % 4
+
+    # The last line of the file may not end with a newline
+    if rest and line_in_record == 1:
+        yield [rest.strip()]
+
+def parse_fasta_blocks(blocks):
+    '''Parse the blocks of a fasta file with reads, a read can span several lines.
+       Yield a list with the dna (as bytes) of the reads in each block.
+    '''
+    rest = b""
+    dna_lines = None   # The lines of the read not yet finished
+    for block in blocks:
+        lines = (rest + block).split(b"\n")
+        rest = lines.pop()
+        dna_reads = []
+        for line in lines:
+            if line.startswith(b">"):
+                if dna_lines is not None:
+                    dna_reads.append(b"".join(dna_lines))
+                dna_lines = []
+            elif dna_lines is not None:
+                dna_lines.append(line.strip())
+        if dna_reads:
+            yield dna_reads
+    if rest and dna_lines is not None and not rest.startswith(b">"):
+        dna_lines.append(rest.strip())
+    if dna_lines is not None:
+        yield [b"".join(dna_lines)]
+
+def read_fastq(filename):
+    '''Extract dna from a file with reads, yield the dna of each read as bytes.
+       The reads can be fastq or fasta, gzip, bgzip, bz2 or xz compressed or not (see read_fastq_batches).
+    '''
+    for dna_reads in read_fastq_batches(filename):
+        yield from dna_reads
+
+def prefetch(iterable, size=4):
+    '''Iterate over iterable in a background thread, keeping up to size items ready.
+       Used to decompress and parse a fastq file while the reads are scanned,
+       zlib releases the GIL while it decompresses.
+    '''
+    items = queue.Queue(size)
+    done = object()
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+            items.put(done)
+        # Errors (also sys.exit from the readers) are raised again in the iterating thread
+        except BaseException as error:
+            items.put(error)
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+def mate_batches(filename1, filename2):
+    '''Read the two mate files of a paired-end sample at the same time,
+       yield the batches of reads of both files in turn
+    '''
+    batches1 = prefetch(read_fastq_batches(filename1))
+    batches2 = prefetch(read_fastq_batches(filename2))
+    for dna_reads1 in batches1:
+        yield dna_reads1
+        yield next(batches2, [])
+    yield from batches2
+
+def paired_batches(filename1, filename2):
+    '''Read the two mate files of a paired-end sample at the same time,
+       yield batches of the fragments as (mate1, mate2) reads
+    '''
+    batches2 = prefetch(read_fastq_batches(filename2))
+    rest2 = []
+    for dna_reads1 in prefetch(read_fastq_batches(filename1)):
+        # Get enough mate2 reads to pair with the mate1 reads
+        while len(rest2) < len(dna_reads1):
+            dna_reads2 = next(batches2, None)
+            if dna_reads2 is None:
+                sys.exit(f"The file '{filename2}' has fewer reads than '{filename1}'")
+            rest2 += dna_reads2
+        yield list(zip(dna_reads1, rest2))
+        rest2 = rest2[len(dna_reads1):]
+    if rest2 or next(batches2, None) is not None:
+        sys.exit(f"The file '{filename1}' has fewer reads than '{filename2}'")
+
+# The 2-bit code of each nucleotide. Both the characters and their byte values
+# are keys, so the encoder works on str and bytes dna alike.
+BASE2BITS = {"A": 0, "C": 1, "G": 2, "T": 3}
+BASE2BITS.update({ord(base): bits for base, bits in list(BASE2BITS.items())})
+# The table for bytes.translate from the bases to their 2 bits, and 4 for a non ACGT character
+BASE2CODE = bytes(BASE2BITS.get(character, 4) for character in range(256))
+
+def encode_canonical_kmers(dna, kmer_len):
+    '''Yield the canonical form of each 2-bit encoded kmer of a dna string,
+       which is the smallest of the kmer and its reverse complement, together
+       with its strand (1 if the kmer was reverse complemented, else 0) and
+       its position in the dna string.
+       Kmers containing a non ACGT character (eg N) are skipped.
        '''
-    # Return empty lists if there is no possible kmer's
-    if kmer_len > len(dna):
-        return [],[]
+    mask = (1 << 2 * kmer_len) - 1
+    shift = 2 * (kmer_len - 1)
+    kmer = 0
+    reverse_kmer = 0   # The reverse complement of kmer
+    valid_len = 0   # Number of ACGT bases in a row ending at pos
+    for pos, base in enumerate(dna):
+        bits = BASE2BITS.get(base)
+        # Reset the encoder if the base is not ACGT
+        if bits is None:
+            kmer = 0
+            reverse_kmer = 0
+            valid_len = 0
+            continue
+        kmer = ((kmer << 2) | bits) & mask
+        # The complement of a base is 3 - bits, and is added to the front
+        reverse_kmer = (reverse_kmer >> 2) | ((3 - bits) << shift)
+        valid_len += 1
+        if valid_len >= kmer_len:
+            if reverse_kmer < kmer:
+                yield reverse_kmer, 1, pos - kmer_len + 1
+            else:
+                yield kmer, 0, pos - kmer_len + 1
 
-    #  Find all possible kmers
-    kmer_list = []
-    range_list = []
-    to_range = len(dna) - kmer_len + 1   #+1 to also add last kmer
-    for i in range(0, to_range):
-        kmer = dna[i: i + kmer_len]
-        kmer_list.append(kmer)
-        range_list.append(i)
+# Parameters of read_is_valid
+MAX_SPACE = 1   # The maximum space allowed in the read covering the gene
+SIDE_BONUS_FRACTION = 0.70   # How much of the read can be outside the gene and still be considered valid
+THRESHOLD_FRACTION = 0.95   # The percent of the read which needs to cover the gene
 
-    return kmer_list, range_list
+def merge_intervals(intervals):
+    '''Sort the stretches (start, end) and merge the overlapping or adjacent ones'''
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
 
-def read_is_valid(depht_count, dna_read):
+def read_is_valid(intervals, len_gene, dna_read):
     '''
     return True if the read is covering enough of the gene,
     else returns False
-    The input is a list of ints representing the depth of each nucleotide. 
+    The input is the sorted and merged stretches (start, end) of the gene covered by the read.
+    '''
+    return coverage_score(intervals, len_gene, len(dna_read)) >= int(THRESHOLD_FRACTION * len(dna_read))
+
+def fragment_is_valid(intervals1, intervals2, len_gene, read_len1, read_len2):
+    '''
+    return True if the two mates of a fragment together are covering enough of the gene:
+    if either mate is valid by itself, or if the sum of their scores reaches the
+    threshold of the combined length of the mates.
+    The input is the sorted and merged stretches of the gene covered by each mate.
+    '''
+    score1 = coverage_score(intervals1, len_gene, read_len1)
+    score2 = coverage_score(intervals2, len_gene, read_len2)
+    return (score1 >= int(THRESHOLD_FRACTION * read_len1) or score2 >= int(THRESHOLD_FRACTION * read_len2)
+            or score1 + score2 >= int(THRESHOLD_FRACTION * (read_len1 + read_len2)))
+
+def coverage_score(intervals, len_gene, read_len):
+    '''
+    return the score of the largest continuous coverage of the gene by a read of length read_len:
+    the number of positions covered, plus SIDE_BONUS for each end of the gene reached.
+    The input is the sorted and merged stretches (start, end) of the gene covered by the read.
     '''
     # Set parameters
-    MAX_SPACE = 1   # The maximum space allowed in the read covering the gene
-    SIDE_BONUS = int(0.70 * len(dna_read))   # How much of the read can be outside the gene and still be considered valid
-    THRESHOLD_SCORE = int(0.95 *len(dna_read))   # The percent of the read which needs to cover the gene
+    SIDE_BONUS = int(SIDE_BONUS_FRACTION * read_len)
 
     # Find the reads largest continuous coverage of the gene.
     # a coverage is considered continuous if the spacing does not exceed the MAX_SPACE 
-    END_OF_GENE = len(depht_count) -1
-    (maxcount, score, exitcount) = (0,0,0)
-    in_coverage = False
-    for pos,value in enumerate(depht_count):
-        # Start counting the coverage when a depht != 0
-        if value == 1: in_coverage = True
-        # Start counting the coverage
-        if in_coverage:
-            # If a position is not covered, start counting to exit
-            if value == 0: exitcount += 1
-            # Else add to the coverage score for each position
-            else: score += 1
+    # The positions are one step from either ends to still get SIDE_BONUS when pos 0 is not covered but pos 1 is.
+    END_OF_GENE = len_gene -1
+    bonus_positions = {0+1, END_OF_GENE -1}
+    maxcount = 0
+    i = 0
+    while i < len(intervals):
+        # Start counting the coverage at a covered stretch
+        (score, exitcount) = (0, 0)
+        while True:
+            start, end = intervals[i]
+            # Add to the coverage score for each position covered
+            score += end - start
+            # The uncovered positions after the stretch are counted untill MAX_SPACE of them are seen
+            next_start = intervals[i + 1][0] if i + 1 < len(intervals) else END_OF_GENE + 1
+            seen_space = min(next_start - end, MAX_SPACE - exitcount)
+            exitcount += seen_space
             # If at either side position of the gene, add a bonus to the score
-            # The positions are one step from either ends to still get SIDE_BONUS when pos 0 is not covered but pos 1 is.
-            if pos in [0+1, END_OF_GENE -1]:  
-                score += SIDE_BONUS
-            # update the maxscore for the read
-            if score > maxcount: maxcount = score
+            for pos in bonus_positions:
+                if start <= pos < end + seen_space:
+                    score += SIDE_BONUS
+            i += 1
             # Stop counting the coverage if spacing exceeds MAX_SPACE
-            if exitcount >= MAX_SPACE:
-                score = 0
-                exitcount = 0
-                in_coverage = False
+            if exitcount >= MAX_SPACE or i == len(intervals):
+                break
+        # update the maxscore for the read
+        if score > maxcount: maxcount = score
+
+    return maxcount
+
+def min_covered_positions(read_len, min_gene_len):
+    '''Return the smallest number of positions of a gene at least min_gene_len long
+       a read of length read_len must cover for read_is_valid to be True
+    '''
+    SIDE_BONUS = int(SIDE_BONUS_FRACTION * read_len)
+    THRESHOLD_SCORE = int(THRESHOLD_FRACTION * read_len)
+    # The score is the covered positions of a stretch with fewer than MAX_SPACE uncovered
+    # positions in it, plus SIDE_BONUS for each end of the gene the stretch reaches.
+    # Reaching both ends needs the stretch to span all of the gene but its first and last
+    # position, and up to MAX_SPACE positions uncovered in and after it.
+    return min(THRESHOLD_SCORE - SIDE_BONUS,
+               max(THRESHOLD_SCORE - 2 * SIDE_BONUS, min_gene_len - 2 - MAX_SPACE))
+
+def min_kmer_hits(read_len, kmer_length, min_gene_len):
+    '''Return the smallest number of kmers of a read which must be found in the
+       genes for read_is_valid to be True for any gene at least min_gene_len long
+    '''
+    # Each kmer found covers kmer_length positions
+    return max(1, -(-min_covered_positions(read_len, min_gene_len) // kmer_length))
+
+def max_minimizer_window(read_len, kmer_length, min_gene_len):
+    '''Return the largest minimizer window for which a read of length read_len which can be valid
+       always shares a minimizer with the gene: the window must fit in the kmers of the shortest
+       stretch without uncovered positions read_is_valid accepts
+    '''
+    # The covered positions are split in at most MAX_SPACE stretches by the uncovered ones
+    min_stretch = -(-min_covered_positions(read_len, min_gene_len) // MAX_SPACE)
+    return max(1, min_stretch - kmer_length + 1)
 
-    return maxcount >= THRESHOLD_SCORE
+def probe_read(read_kmers, kmer2gene2kmerpos, kmer_length, min_hits):
+    '''Prefilter of a read, return False if fewer than min_hits of the read_kmers
+       can be in the genes. The kmers are probed at positions kmer_length apart
+       first, and the probing stops as soon as enough probes missed (return False)
+       or enough were found (return True).
+    '''
+    max_misses = len(read_kmers) - min_hits
+    (hits, misses) = (0, 0)
+    for start in range(kmer_length):
+        for kmer, _, _ in read_kmers[start::kmer_length]:
+            if kmer in kmer2gene2kmerpos:
+                hits += 1
+                if hits >= min_hits:
+                    return True
+            else:
+                misses += 1
+                if misses > max_misses:
+                    return False
+    return False
 
 def coverage_stats(depht_count):
     '''from depht array return coverage, avg depht and min_depht
@@ -159,82 +582,2220 @@ def coverage_stats(depht_count):
     avg_depht = total_depht / len(depht_count)
     return coverage, avg_depht, min_depth
 
-# Setting up the argument parser
-(kmer_length,gene_filename,read_filename) = argument_parser(sys.argv, 19, "resistance_genes.fsa", "Unknown3_raw_reads_1.txt.gz")
+class Stats:
+    '''Wall and cpu time of each stage of a run and counters, reported with --stats.
+       Stages can be nested, the time of a stage does not include the stages inside it.
+       A Stats which is not enabled does nothing, so it can be passed around for free.
+       With profile_workers the worker processes profile their scans with cProfile, and
+       the profiles are sent back in worker_profiles (as pstats data) for --profile.
+    '''
+    def __init__(self, enabled=True, profile_workers=False):
+        self.enabled = enabled
+        self.profile_workers = profile_workers
+        self.worker_profiles = []
+        self.stage2time = dict()   # {"stage": [wall_time, cpu_time]}
+        self.counters = dict()
+        self.gene2valid_reads = dict()
+        self.stages = []   # The stages entered and not yet exited
+        self.last_time = (time.perf_counter(), time.process_time())
+
+    def _charge(self):
+        '''Add the time since the last enter or exit to the current stage'''
+        now = (time.perf_counter(), time.process_time())
+        if self.stages:
+            stage_time = self.stage2time.setdefault(self.stages[-1], [0.0, 0.0])
+            stage_time[0] += now[0] - self.last_time[0]
+            stage_time[1] += now[1] - self.last_time[1]
+        self.last_time = now
+
+    def enter(self, stage):
+        if self.enabled:
+            self._charge()
+            self.stages.append(stage)
+
+    def exit(self):
+        if self.enabled:
+            self._charge()
+            self.stages.pop()
+
+    @contextmanager
+    def stage(self, stage):
+        self.enter(stage)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def timed_iter(self, stage, iterable):
+        '''Return the iterable, with the time spent getting its elements added to stage'''
+        if not self.enabled:
+            return iterable
+        def timed():
+            iterator = iter(iterable)
+            while True:
+                self.enter(stage)
+                try:
+                    element = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.exit()
+                yield element
+        return timed()
+
+    def count(self, counter, n=1):
+        if self.enabled:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def valid_read(self, genename):
+        '''Count a read passing read_is_valid for the gene'''
+        if self.enabled:
+            self.gene2valid_reads[genename] = self.gene2valid_reads.get(genename, 0) + 1
+
+    def merge(self, other):
+        '''Add the times and counters of another Stats (eg from a worker process) to these'''
+        for stage, (wall_time, cpu_time) in other.stage2time.items():
+            stage_time = self.stage2time.setdefault(stage, [0.0, 0.0])
+            stage_time[0] += wall_time
+            stage_time[1] += cpu_time
+        for counter, n in other.counters.items():
+            self.count(counter, n)
+        for genename, n in other.gene2valid_reads.items():
+            self.gene2valid_reads[genename] = self.gene2valid_reads.get(genename, 0) + n
+        self.worker_profiles.extend(other.worker_profiles)
+
+    def report(self):
+        '''Return the times and counters as a dict which can be saved as JSON'''
+        return {"stages": {stage: {"wall_seconds": wall_time, "cpu_seconds": cpu_time}
+                           for stage, (wall_time, cpu_time) in self.stage2time.items()},
+                "counters": dict(self.counters),
+                "valid_reads_per_gene": dict(self.gene2valid_reads)}
+
+NO_STATS = Stats(enabled=False)
+
+class DephtCounts:
+    '''The total depht count of each gene, saved as {"gene_name": depht_count}
+       where depht_count is a list with the depht of each nucleotide
+    '''
+    def __init__(self):
+        self.gene2depht_count = dict()
+
+    def add(self, genename, intervals, len_gene):
+        '''Add a read covering the stretches (start, end) of the gene'''
+        if genename not in self.gene2depht_count:
+            self.gene2depht_count[genename] = [0] * len_gene
+        depht_count = self.gene2depht_count[genename]
+        for start, end in intervals:
+            for i in range(start, end):
+                depht_count[i] += 1
+
+    def merge(self, other):
+        '''Add the depht counts of another DephtCounts elementwise to these'''
+        for genename, depht_count in other.gene2depht_count.items():
+            if genename in self.gene2depht_count:
+                total_depht_count = self.gene2depht_count[genename]
+                for i in range(len(total_depht_count)):
+                    total_depht_count[i] += depht_count[i]
+            else:
+                self.gene2depht_count[genename] = depht_count
+
+    def depht_counts(self):
+        '''Yield the name and depht count of each gene'''
+        yield from self.gene2depht_count.items()
 
+    def add_depht_count(self, genename, depht_count):
+        '''Add the depht count of a gene (eg from a depht profile) elementwise to these'''
+        if genename in self.gene2depht_count:
+            total_depht_count = self.gene2depht_count[genename]
+            for i in range(len(total_depht_count)):
+                total_depht_count[i] += depht_count[i]
+        else:
+            self.gene2depht_count[genename] = list(depht_count)
+
+    def coverage_stats(self):
+        '''Return {"gene_name": (coverage, avg_depht, min_depht)} for each gene
+           in the order the genes were first added
+        '''
+        return {genename: coverage_stats(depht_count) for genename, depht_count in self.gene2depht_count.items()}
+
+class NumpyDephtCounts:
+    '''The total depht count of all genes saved in one contiguous int32 numpy array.
+       The genes are placed in the array in the order they are first added,
+       gene2offset holds {"gene_name": (offset, length_gene)} for each gene.
+    '''
+    def __init__(self):
+        if np is None:
+            sys.exit("The numpy depht counts needs numpy to be installed")
+        self.depht = np.zeros(1 << 16, dtype=np.int32)
+        self.size = 0
+        self.gene2offset = dict()
+
+    def offset(self, genename, len_gene):
+        '''Return the offset of the gene in the array, place it at the end if new'''
+        if genename not in self.gene2offset:
+            # Double the array when it is full
+            if self.size + len_gene > len(self.depht):
+                depht = np.zeros(max(2 * len(self.depht), self.size + len_gene), dtype=np.int32)
+                depht[:self.size] = self.depht[:self.size]
+                self.depht = depht
+            self.gene2offset[genename] = (self.size, len_gene)
+            self.size += len_gene
+        return self.gene2offset[genename][0]
+
+    def add(self, genename, intervals, len_gene):
+        '''Add a read covering the stretches (start, end) of the gene, each as one slice increment'''
+        offset = self.offset(genename, len_gene)
+        for start, end in intervals:
+            self.depht[offset + start: offset + end] += 1
+
+    def merge(self, other):
+        '''Add the depht counts of another NumpyDephtCounts to these'''
+        for genename, (other_offset, len_gene) in other.gene2offset.items():
+            offset = self.offset(genename, len_gene)
+            self.depht[offset: offset + len_gene] += other.depht[other_offset: other_offset + len_gene]
+
+    def depht_counts(self):
+        '''Yield the name and depht count (a view of the array) of each gene'''
+        for genename, (offset, len_gene) in self.gene2offset.items():
+            yield genename, self.depht[offset: offset + len_gene]
+
+    def add_depht_count(self, genename, depht_count):
+        '''Add the depht count of a gene (eg from a depht profile) to these'''
+        offset = self.offset(genename, len(depht_count))
+        self.depht[offset: offset + len(depht_count)] += np.asarray(depht_count, dtype=np.int32)
+
+    def coverage_stats(self):
+        '''Return {"gene_name": (coverage, avg_depht, min_depht)} for each gene
+           in the order the genes were first added.
+           The stats of all genes are found with one reduction over the array.
+        '''
+        if not self.gene2offset:
+            return dict()
+        depht = self.depht[:self.size]
+        offsets = np.fromiter((offset for offset, _ in self.gene2offset.values()), dtype=np.int64)
+        total_depht = np.add.reduceat(depht, offsets, dtype=np.int64).tolist()
+        count = np.add.reduceat(depht != 0, offsets, dtype=np.int64).tolist()
+        min_depht = np.minimum.reduceat(depht, offsets).tolist()
+
+        gene2stats = dict()
+        for i, (genename, (_, len_gene)) in enumerate(self.gene2offset.items()):
+            gene2stats[genename] = (count[i] / len_gene, total_depht[i] / len_gene, min(min_depht[i], 99999))
+        return gene2stats
+
+# The layout of a depht profile file, the depht counts of a (partial) scan. All values are
+# little endian and every section starts 8 byte aligned, so an uncompressed file can be memory mapped:
+#   header:      magic, version, bytes per depht (2 or 4), if the dephts are zlib compressed,
+#                number of genes, length of the metadata and of the depht section
+#   metadata:    utf-8 JSON with the kmer length, sha256 of the gene file, the read files,
+#                the number of reads scanned, if the scan is complete and the names of the genes
+#   genes:       offset of the dephts of each gene (uint64), and the number of covered positions (uint32),
+#                min depht (uint32) and total depht (uint64) of each gene
+#   dephts:      the depht of each position of the genes (uint16 or uint32)
+DEPHT_MAGIC = b"GIRDEPHT"
+DEPHT_VERSION = 2
+DEPHT_HEADER = struct.Struct("<8sIIIQQQ")
+
+def write_depht_profile(profile_filename, TOTALgene2depht_count, metadata, compress=False):
+    '''Save the depht counts with the metadata (a dict) as a depht profile file, with the dephts
+       zlib compressed if compress. The file is written to a temporary file first, so an earlier
+       profile is only replaced by a complete one.
+    '''
+    genenames = []
+    dephts = []
+    gene_offsets = array("Q", [0])
+    (covered, min_dephts, total_dephts) = (array("I"), array("I"), array("Q"))
+    for genename, depht_count in TOTALgene2depht_count.depht_counts():
+        depht_count = array("I", depht_count)
+        genenames.append(genename)
+        dephts.append(depht_count)
+        gene_offsets.append(gene_offsets[-1] + len(depht_count))
+        covered.append(len(depht_count) - depht_count.count(0))
+        min_dephts.append(min(depht_count, default=0))
+        total_dephts.append(sum(depht_count))
+
+    # The dephts take 2 bytes each if they are all below 65536
+    typecode = "H" if max((max(depht_count, default=0) for depht_count in dephts), default=0) < 1 << 16 else "I"
+    depht_data = array(typecode)
+    for depht_count in dephts:
+        depht_data.extend(array(typecode, depht_count) if typecode == "H" else depht_count)
+    if sys.byteorder != "little":
+        for values in (gene_offsets, covered, min_dephts, total_dephts, depht_data):
+            values.byteswap()
+    depht_data = zlib.compress(depht_data.tobytes()) if compress else depht_data.tobytes()
+
+    metadata = json.dumps(dict(metadata, genes=genenames)).encode("utf-8")
+    with atomic_write(profile_filename) as file:
+        file.write(DEPHT_HEADER.pack(DEPHT_MAGIC, DEPHT_VERSION, array(typecode).itemsize, int(compress),
+                                     len(genenames), len(metadata), len(depht_data)))
+        file.write(metadata)
+        for section in (gene_offsets, covered, min_dephts, total_dephts, depht_data):
+            _pad(file)
+            file.write(section)
+
+class DephtProfile:
+    '''A depht profile file, memory mapped. The stats of each gene are read from the gene table,
+       the dephts of a gene are only read (and decompressed) when asked for.
+    '''
+    def __init__(self, profile_filename):
+        try: file = open(profile_filename, "rb")
+        except FileNotFoundError as errormessage:
+            sys.exit(f"The file '{profile_filename}' could not be found, error: {errormessage}")
+        with file:
+            try:
+                self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                (magic, version, itemsize, self.compressed, n_genes, metadata_length,
+                    depht_length) = DEPHT_HEADER.unpack_from(self.mapped)
+            except (ValueError, struct.error):
+                magic = version = None
+        if (magic, version) != (DEPHT_MAGIC, DEPHT_VERSION):
+            sys.exit(f"The file '{profile_filename}' is not a depht profile")
+        self.profile_filename = profile_filename
+        offset = DEPHT_HEADER.size
+        self.metadata = json.loads(bytes(self.mapped[offset: offset + metadata_length]))
+        self.genenames = self.metadata.pop("genes")
+        offset += metadata_length
+
+        # Find the sections of the file and view them as arrays
+        view = memoryview(self.mapped)
+        sections = []
+        for fmt, length in (("Q", n_genes + 1), ("I", n_genes), ("I", n_genes), ("Q", n_genes), ("B", depht_length)):
+            offset += -offset % 8
+            size = struct.calcsize(fmt) * length
+            if offset + size > len(self.mapped):
+                sys.exit(f"The depht profile '{profile_filename}' is truncated")
+            sections.append(view[offset: offset + size].cast(fmt))
+            offset += size
+        (self.gene_offsets, self.covered, self.min_dephts, self.total_dephts, depht_data) = sections
+        self.typecode = "H" if itemsize == 2 else "I"
+        self.depht_data = depht_data if not self.compressed else None
+        self.compressed_depht_data = depht_data if self.compressed else None
+
+    def coverage_stats(self):
+        '''Return {"gene_name": (coverage, avg_depht, min_depht)} for each gene, as DephtCounts.coverage_stats'''
+        gene2stats = dict()
+        for i, genename in enumerate(self.genenames):
+            len_gene = self.gene_offsets[i + 1] - self.gene_offsets[i]
+            gene2stats[genename] = (self.covered[i] / len_gene, self.total_dephts[i] / len_gene, min(self.min_dephts[i], 99999))
+        return gene2stats
+
+    def depht_count(self, i):
+        '''Return the depht of each position of gene number i as an array'''
+        if self.depht_data is None:
+            self.depht_data = memoryview(zlib.decompress(self.compressed_depht_data))
+        depht_count = array(self.typecode)
+        itemsize = depht_count.itemsize
+        depht_count.frombytes(self.depht_data[self.gene_offsets[i] * itemsize: self.gene_offsets[i + 1] * itemsize])
+        if sys.byteorder != "little":
+            depht_count.byteswap()
+        return depht_count
+
+    def depht_counts(self):
+        '''Yield the name and depht count of each gene'''
+        for i, genename in enumerate(self.genenames):
+            yield genename, self.depht_count(i)
+
+def read_depht_profile(profile_filename, TOTALgene2depht_count):
+    '''Add the depht counts in a depht profile file to TOTALgene2depht_count, return its metadata'''
+    profile = DephtProfile(profile_filename)
+    for genename, depht_count in profile.depht_counts():
+        TOTALgene2depht_count.add_depht_count(genename, depht_count)
+    return profile.metadata
+
+class KmerIndex(dict):
+    '''The index kmer2gene2kmerpos, a dict which also knows the length of its shortest gene'''
+    min_gene_length = 0
+
+class PostingIndex:
+    '''Base of the indexes keeping the postings of the kmers in flat arrays.
+       The genes are numbered (gene ids) and their lengths kept in gene_lengths.
+       posting(kmer) returns the posting of a kmer as posting_id << 32 | base, with the
+       base position in the lower 31 bits and the base strand in bit 31. The postings of
+       the kmer are then posting_genes and posting_positions [posting_offsets[posting_id]: posting_offsets[posting_id + 1]],
+       the gene ids and the kmer positions in the genes (minus the base position)
+       with the strand (xor the base strand) in the highest bit.
+    '''
+    min_gene_length = 0
+
+    def get(self, kmer, default=None):
+        '''Return {"gene_name": (kmer_position_in_gene, length_gene, strand)}
+           for the kmer like kmer2gene2kmerpos.get
+        '''
+        posting = self.posting(kmer)
+        if posting is None:
+            return default
+        (posting_id, base, base_strand) = (posting >> 32, posting & ~STRAND_BIT & 0xFFFFFFFF, posting >> 31 & 1)
+        gene2kmerpos = dict()
+        for i in range(self.posting_offsets[posting_id], self.posting_offsets[posting_id + 1]):
+            gene_id = self.posting_genes[i]
+            position = self.posting_positions[i]
+            gene2kmerpos[self.genename(gene_id)] = (base + (position & ~STRAND_BIT), self.gene_lengths[gene_id],
+                                                    base_strand ^ position >> 31)
+        return gene2kmerpos
+
+    def __contains__(self, kmer):
+        return self.posting(kmer) is not None
+
+    def __getitem__(self, kmer):
+        gene2kmerpos = self.get(kmer)
+        if gene2kmerpos is None:
+            raise KeyError(kmer)
+        return gene2kmerpos
+
+class CompactKmerIndex(PostingIndex):
+    '''The index of the canonical kmers of the genes used in place of kmer2gene2kmerpos.
+       kmer2posting maps each kmer to its posting. The posting lists are relative to the
+       base position and strand of the kmer, so the kmers shared by a family of similar
+       genes at the same positions all use the same posting list, which is stored once.
+       The headers of the genes are kept in genenames.
+    '''
+    def __init__(self):
+        self.genenames = []
+        self.gene_lengths = array("I")
+        self.kmer2posting = dict()
+        self.posting_offsets = array("Q", [0])
+        self.posting_genes = array("I")
+        self.posting_positions = array("I")
+
+    def __len__(self):
+        return len(self.kmer2posting)
+
+    def __iter__(self):
+        return iter(self.kmer2posting)
+
+    def genename(self, gene_id):
+        return self.genenames[gene_id]
+
+    def posting(self, kmer):
+        return self.kmer2posting.get(kmer)
+
+def add_gene_postings(kmer2postings, gene_id, dna, kmer_length):
+    '''Add the postings of the canonical kmers of a gene to kmer2postings, as
+       gene_id << 32 | position << 1 | strand. A single posting is kept as an int and more as a list.
+    '''
+    # Both strands of the gene are covered by its canonical kmers
+    for kmer, strand, kmer_pos_in_gene in encode_canonical_kmers(dna, kmer_length):
+        posting = gene_id << 32 | kmer_pos_in_gene << 1 | strand
+        postings = kmer2postings.get(kmer)
+        if postings is None:
+            kmer2postings[kmer] = posting
+        # A kmer seen again in the same gene keeps its last position
+        elif isinstance(postings, int):
+            kmer2postings[kmer] = posting if postings >> 32 == gene_id else [postings, posting]
+        elif postings[-1] >> 32 == gene_id:
+            postings[-1] = posting
+        else:
+            postings.append(posting)
+
+def _build_postings_of_slice(args):
+    '''Return kmer2postings of the genes in a slice, a list of (gene_id, dna), for build_index in a worker'''
+    (genes, kmer_length) = args
+    kmer2postings = dict()
+    for gene_id, dna in genes:
+        add_gene_postings(kmer2postings, gene_id, dna, kmer_length)
+    return kmer2postings
+
+def merge_postings(kmer2postings, PARTkmer2postings):
+    '''Add the postings of later genes in PARTkmer2postings to kmer2postings, giving the same
+       postings (and order of the kmers) as if the genes had been added by add_gene_postings
+    '''
+    shared = {}
+    for kmer in kmer2postings.keys() & PARTkmer2postings.keys():
+        (postings, more) = (kmer2postings[kmer], PARTkmer2postings[kmer])
+        postings = [postings] if isinstance(postings, int) else postings
+        more = [more] if isinstance(more, int) else more
+        # A kmer seen again in the same gene keeps its last position
+        if postings[-1] >> 32 == more[0] >> 32:
+            postings = postings[:-1]
+        postings = postings + more
+        shared[kmer] = postings[0] if len(postings) == 1 else postings
+    # New kmers are added in their order in the part, after the kmers already seen
+    kmer2postings.update(PARTkmer2postings)
+    kmer2postings.update(shared)
+
+# The number of gene bases in each slice of genes sent to a worker by build_index
+INDEX_SLICE_BASES = 1 << 18
+
+def gene_slices(genes, slice_bases=INDEX_SLICE_BASES):
+    '''Yield lists of (gene_id, dna) of about slice_bases bases from genes'''
+    genes_slice = []
+    n_bases = 0
+    for gene_id, dna in genes:
+        genes_slice.append((gene_id, bytes(dna)))
+        n_bases += len(dna)
+        if n_bases >= slice_bases:
+            yield genes_slice
+            genes_slice = []
+            n_bases = 0
+    if genes_slice:
+        yield genes_slice
+
+def build_index(gene_filename, kmer_length, stats=NO_STATS, threads=1):
+    '''Read in the file with the antibiotic resistence genes and return
+       the index (CompactKmerIndex) with the canonical kmers of the genes,
+       where the strand of a posting is 1 if the kmer is reverse complemented in the gene.
+       With threads > 1 slices of the genes are indexed by a pool of worker processes, and
+       the parts merged in the order of the genes, so the index is the same as with one.
+    '''
+    index = CompactKmerIndex()
+    gene2id = dict()
+    def numbered_genes():
+        '''Yield (gene_id, dna) of the genes, a gene with the header of an earlier gene gets its id'''
+        for dna, header in stats.timed_iter("fasta_parse", read_fasta(gene_filename, mapped=True)):
+            if header not in gene2id:
+                gene2id[header] = len(index.genenames)
+                index.genenames.append(header)
+                index.gene_lengths.append(len(dna))
+            gene_id = gene2id[header]
+            index.gene_lengths[gene_id] = len(dna)
+            yield gene_id, dna
+
+    # The postings of each kmer while the genes are read, as gene_id << 32 | position << 1 | strand,
+    # a single posting is kept as an int and more as a list
+    kmer2postings = dict()
+    if threads > 1:
+        with multiprocessing.Pool(threads) as pool:
+            parts = pool.imap(_build_postings_of_slice, ((genes_slice, kmer_length) for genes_slice in gene_slices(numbered_genes())))
+            for PARTkmer2postings in parts:
+                if kmer2postings:
+                    merge_postings(kmer2postings, PARTkmer2postings)
+                else:
+                    kmer2postings = PARTkmer2postings
+    else:
+        for gene_id, dna in numbered_genes():
+            add_gene_postings(kmer2postings, gene_id, dna, kmer_length)
+
+    # Make the postings relative to the lowest position and the strand of the first gene,
+    # and store each distinct relative posting list once in the flat arrays.
+    # The postings of each kmer are replaced by its posting in place, the dict becomes kmer2posting.
+    posting_list2id = dict()
+    for kmer, postings in kmer2postings.items():
+        # A single posting is relative to itself
+        if isinstance(postings, int):
+            (base, base_strand, relative) = ((postings & 0xFFFFFFFF) >> 1, postings & 1, ((postings >> 32, 0),))
+        else:
+            base = min(posting & 0xFFFFFFFF for posting in postings) >> 1
+            base_strand = postings[0] & 1
+            relative = tuple((posting >> 32, ((posting & 0xFFFFFFFF) >> 1) - base | (STRAND_BIT if (posting ^ base_strand) & 1 else 0))
+                             for posting in postings)
+        posting_id = posting_list2id.get(relative)
+        if posting_id is None:
+            posting_id = posting_list2id[relative] = len(posting_list2id)
+            for gene_id, position in relative:
+                index.posting_genes.append(gene_id)
+                index.posting_positions.append(position)
+            index.posting_offsets.append(len(index.posting_genes))
+        kmer2postings[kmer] = posting_id << 32 | (STRAND_BIT if base_strand else 0) | base
+    index.kmer2posting = kmer2postings
+    index.min_gene_length = min(index.gene_lengths, default=0)
+    return index
+
+# The layout of a prebuilt index file. All values are little endian and every
+# section starts 8 byte aligned, so the arrays can be used directly from a mmap:
+#   header:      magic, version, kmer_length, number of genes, kmers and postings,
+#                sha256 of the gene file
+#   genes:       length of each gene (uint32), offsets of the headers (uint64),
+#                utf-8 encoded headers
+#   kmers:       the sorted encoded kmers (uint64), offset of the postings of
+#                each kmer (uint64)
+#   postings:    gene id (uint32) and kmer position in the gene (uint32) with
+#                the strand in the highest bit
+INDEX_MAGIC = b"GIRINDEX"
+INDEX_VERSION = 2
+STRAND_BIT = 1 << 31
+INDEX_HEADER = struct.Struct("<8sIIQQQ32s")
+
+def gene_file_digest(gene_filename):
+    '''Return the sha256 digest of the content of the gene file'''
+    digest = hashlib.sha256()
+    try: file = open(gene_filename, "rb")
+    except FileNotFoundError as errormessage:
+        sys.exit(f"The file '{gene_filename}' could not be found, error: {errormessage}")
+    with file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+@contextmanager
+def atomic_write(filename):
+    '''Open a temporary file to write in place of filename, and replace filename with it when
+       it is complete. A process which has the old file mapped keeps it, and a write which is
+       killed or fails never leaves a partial file behind.
+    '''
+    temporary_filename = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_filename, "wb") as file:
+            yield file
+        os.replace(temporary_filename, filename)
+    finally:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+
+def _pad(file):
+    '''Pad the file with zeros up to the next 8 byte boundary'''
+    file.write(bytes(-file.tell() % 8))
+
+def write_index(index_filename, index, kmer_length, digest):
+    '''Save the index (CompactKmerIndex) as a memory mappable binary file'''
+    # The postings of each kmer are written out in the order of the sorted kmers
+    kmers = array("Q", sorted(index.kmer2posting))
+    posting_offsets = array("Q", [0])
+    posting_genes = array("I")
+    posting_positions = array("I")
+    for kmer in kmers:
+        posting = index.kmer2posting[kmer]
+        (posting_id, base, base_strand) = (posting >> 32, posting & ~STRAND_BIT & 0xFFFFFFFF, posting & STRAND_BIT)
+        for i in range(index.posting_offsets[posting_id], index.posting_offsets[posting_id + 1]):
+            posting_genes.append(index.posting_genes[i])
+            posting_positions.append((base + index.posting_positions[i]) ^ base_strand)
+        posting_offsets.append(len(posting_genes))
+
+    gene_lengths = array("I", index.gene_lengths)
+    headers = [genename.encode("utf-8") for genename in index.genenames]
+    header_offsets = array("Q", [0])
+    for header in headers:
+        header_offsets.append(header_offsets[-1] + len(header))
+
+    if sys.byteorder != "little":
+        for values in (gene_lengths, header_offsets, kmers, posting_offsets, posting_genes, posting_positions):
+            values.byteswap()
+
+    with atomic_write(index_filename) as file:
+        file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, kmer_length,
+                                     len(headers), len(kmers), len(posting_genes), digest))
+        for section in (gene_lengths, header_offsets, b"".join(headers),
+                        kmers, posting_offsets, posting_genes, posting_positions):
+            _pad(file)
+            file.write(section)
+
+class MappedKmerIndex(PostingIndex):
+    '''A prebuilt index file memory mapped and used in place of kmer2gene2kmerpos.
+       The posting id of a kmer is its number in the sorted kmers. The kmers are found in
+       kmer2posting, a dict made from the mapped kmers at the first lookup, as a binary search
+       in the mapped file for each kmer is slower than building the index. select_index makes it
+       before any process is forked, so the forked processes share it.
+       With --csr the mapped arrays are searched in batches with numpy instead (NumpyKmerIndex).
+    '''
+    def __init__(self, index_filename):
+        self.index_filename = index_filename
+        with open(index_filename, "rb") as file:
+            self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.version, self.kmer_length, n_genes, n_kmers, n_postings,
+            self.digest) = INDEX_HEADER.unpack_from(self.mapped)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"'{index_filename}' is not an index file")
+
+        # Find the sections of the file and view them as arrays. A file shorter than
+        # its sections (from a build which was killed) is not an index file.
+        view = memoryview(self.mapped)
+        offset = INDEX_HEADER.size
+        sections = []
+        for itemsize, fmt, length in ((4, "I", n_genes), (8, "Q", n_genes + 1), (1, "B", None),
+                                      (8, "Q", n_kmers), (8, "Q", n_kmers + 1),
+                                      (4, "I", n_postings), (4, "I", n_postings)):
+            offset += -offset % 8
+            if length is None:
+                # The header bytes are as long as the last header offset
+                length = sections[1][-1]
+            if offset + itemsize * length > len(self.mapped):
+                raise ValueError(f"The index file '{index_filename}' is truncated")
+            sections.append(view[offset: offset + itemsize * length].cast(fmt))
+            offset += itemsize * length
+        (self.gene_lengths, self.header_offsets, self.headers,
+            self.kmers, self.posting_offsets, self.posting_genes, self.posting_positions) = sections
+        self.decoded_genenames = dict()
+        self.min_gene_length = min(self.gene_lengths, default=0)
+        self._kmer2posting = None
+
+    def __reduce__(self):
+        # Worker processes map the file again instead of copying it
+        return (MappedKmerIndex, (self.index_filename,))
+
+    def __len__(self):
+        return len(self.kmers)
+
+    def genename(self, gene_id):
+        '''Return the header of a gene, decoding it the first time it is used'''
+        if gene_id not in self.decoded_genenames:
+            start = self.header_offsets[gene_id]
+            end = self.header_offsets[gene_id + 1]
+            self.decoded_genenames[gene_id] = bytes(self.headers[start:end]).decode("utf-8")
+        return self.decoded_genenames[gene_id]
+
+    @property
+    def kmer2posting(self):
+        '''The posting of each kmer as in CompactKmerIndex, the postings in the file are not relative,
+           the base position and strand are 0
+        '''
+        if self._kmer2posting is None:
+            self._kmer2posting = dict(zip(self.kmers, range(0, len(self.kmers) << 32, 1 << 32)))
+        return self._kmer2posting
+
+    def posting(self, kmer):
+        return self.kmer2posting.get(kmer)
+
+def load_index(index_filename, gene_filename, kmer_length, threads=1):
+    '''Return the prebuilt index in index_filename. If the file is missing or
+       was built from another gene file or kmer length it is rebuilt first, by threads processes.
+    '''
+    digest = gene_file_digest(gene_filename)
+    try:
+        index = MappedKmerIndex(index_filename)
+        if (index.version, index.kmer_length, index.digest) == (INDEX_VERSION, kmer_length, digest):
+            return index
+    except (FileNotFoundError, ValueError, struct.error):
+        pass
+    write_index(index_filename, build_index(gene_filename, kmer_length, threads=threads), kmer_length, digest)
+    return MappedKmerIndex(index_filename)
+
+class NumpyKmerIndex(PostingIndex):
+    '''The index as numpy arrays in the layout of the index file: the sorted kmers (uint64),
+       the offsets of the postings of each kmer (CSR), and the gene ids and positions of the postings,
+       with the strand in the highest bit of the position. The posting id of a kmer is its number
+       in the sorted kmers. Made from a CompactKmerIndex, or from a MappedKmerIndex without copying
+       the arrays out of the mapped file. The reads are scanned in batches with scan_reads_csr.
+    '''
+    def __init__(self, index, bloom=None):
+        if np is None:
+            sys.exit("The sorted array index needs numpy to be installed")
+        # A BloomFilter of the kmers, tested before the kmers are looked up
+        self.bloom = bloom
+        self.min_gene_length = index.min_gene_length
+        if isinstance(index, MappedKmerIndex):
+            self.mapped_index = index
+            self.genename = index.genename
+            (self.kmers, self.posting_offsets, self.posting_genes, self.posting_positions, self.gene_lengths) = (
+                np.frombuffer(values, dtype=dtype) for values, dtype in
+                ((index.kmers, "<u8"), (index.posting_offsets, "<u8"), (index.posting_genes, "<u4"),
+                 (index.posting_positions, "<u4"), (index.gene_lengths, "<u4")))
+            return
+
+        # Expand the relative posting list of each kmer to its own postings, as write_index does
+        self.mapped_index = None
+        self.genenames = index.genenames
+        self.genename = index.genename
+        self.gene_lengths = np.frombuffer(index.gene_lengths, dtype=np.uint32)
+        self.kmers = np.fromiter(sorted(index.kmer2posting), dtype=np.uint64, count=len(index.kmer2posting))
+        postings = np.fromiter((index.kmer2posting[kmer] for kmer in self.kmers.tolist()), dtype=np.uint64, count=len(self.kmers))
+        (posting_ids, bases, base_strands) = (postings >> 32, postings & 0x7FFFFFFF, postings & STRAND_BIT)
+        relative_offsets = np.frombuffer(index.posting_offsets, dtype=np.uint64)
+        (starts, lengths) = expand_ranges(relative_offsets[posting_ids], relative_offsets[posting_ids + 1])
+        self.posting_offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.uint64)
+        self.posting_genes = np.frombuffer(index.posting_genes, dtype=np.uint32)[starts]
+        positions = np.frombuffer(index.posting_positions, dtype=np.uint32)[starts].astype(np.uint64)
+        self.posting_positions = ((positions + np.repeat(bases, lengths)) ^ np.repeat(base_strands, lengths)).astype(np.uint32)
+
+    def __reduce__(self):
+        # Worker processes map the file again instead of copying it
+        if self.mapped_index is not None:
+            return (NumpyKmerIndex, (self.mapped_index, self.bloom))
+        return object.__reduce__(self)
+
+    def __len__(self):
+        return len(self.kmers)
+
+    def posting(self, kmer):
+        i = int(np.searchsorted(self.kmers, kmer))
+        if i == len(self.kmers) or self.kmers[i] != kmer:
+            return None
+        return i << 32
+
+# The layout of a saved bloom filter: magic, bits per kmer, number of hash functions,
+# number of kmers and of blocks, kmer length, sha256 of the gene file, then the blocks as uint64 words
+BLOOM_MAGIC = b"GIRBLOOM"
+BLOOM_HEADER = struct.Struct("<8sIIQQI32s")
+BLOOM_BLOCK_WORDS = 8   # A block of 512 bits is one cache line
+BLOOM_HASH = 0xBF58476D1CE4E5B9
+
+class BloomFilter:
+    '''A blocked bloom filter of the kmers of an index, kept in numpy uint64 words.
+       Each kmer sets n_hashes bits within one 512 bit block, so testing a kmer reads one cache line.
+       Kmers not in the filter are surely not in the index, the rest may be (false positives).
+    '''
+    def __init__(self, words, n_hashes, bits_per_kmer, n_kmers):
+        self.words = words
+        self.n_hashes = n_hashes
+        self.bits_per_kmer = bits_per_kmer
+        self.n_kmers = n_kmers
+        self.n_blocks = len(words) // BLOOM_BLOCK_WORDS
 
-# Read in the file with the antibiotic resistence genes and save it in the datastructure kmer2gene2kmerpos
-kmer2gene2kmerpos = dict()
-trans = str.maketrans("ACTG","TGAC")
-for non_complement_dna, header in read_fasta(gene_filename):
-    # Complement the dna strand (non_complement_dna) given in the gene files
-    complement_dna= non_complement_dna.translate(trans)
+    def _bits(self, kmers):
+        '''Yield the word and bit of each hash function for the kmers (numpy uint64)'''
+        # The block from the high bits of one hash, the bits in the block from 9 bit pieces of another
+        block = (((kmers * np.uint64(MINIMIZER_HASH)) >> np.uint64(32)) * np.uint64(self.n_blocks)) >> np.uint64(32)
+        first_word = block * np.uint64(BLOOM_BLOCK_WORDS)
+        bits = kmers * np.uint64(BLOOM_HASH)
+        bits ^= bits >> np.uint64(31)
+        for i in range(self.n_hashes):
+            bit = (bits >> np.uint64(9 * i)) & np.uint64(511)
+            yield first_word + (bit >> np.uint64(6)), bit & np.uint64(63)
 
-    # Go through all possible variations of the gene dna
-    for dna in [non_complement_dna, complement_dna,non_complement_dna[::-1], complement_dna[::-1]]:
-        # Make "gene_data" datastructure which consists of: {Kmer: {"gene_name":(kmer_position_in_gene,length_gene)}}
-        (kmer_list, kmer_positions) = get_kmers_and_pos(dna, kmer_length)
-        for kmer, kmer_pos_in_gene in zip(kmer_list, kmer_positions):
+    def add(self, kmers):
+        for word, bit in self._bits(kmers):
+            np.bitwise_or.at(self.words, word, np.uint64(1) << bit)
+
+    def __contains__(self, kmer):
+        return bool(self.contains(np.array([kmer], dtype=np.uint64))[0])
+
+    def contains(self, kmers):
+        '''Return a numpy bool array, False for the kmers which are not in the index'''
+        maybe = np.ones(len(kmers), dtype=bool)
+        for word, bit in self._bits(kmers):
+            maybe &= ((self.words[word] >> bit) & np.uint64(1)).astype(bool)
+        return maybe
+
+    def expected_fpr(self):
+        '''The false positive rate of a bloom filter of the same size, a blocked filter has a bit more'''
+        bits = self.n_blocks * BLOOM_BLOCK_WORDS * 64
+        return (1 - math.exp(-self.n_hashes * self.n_kmers / bits)) ** self.n_hashes
+
+def build_bloom_filter(kmers, bits_per_kmer):
+    '''Return a BloomFilter of the kmers (numpy uint64) with about bits_per_kmer bits for each kmer'''
+    n_blocks = max(1, -(-len(kmers) * bits_per_kmer // (BLOOM_BLOCK_WORDS * 64)))
+    # The number of hash functions giving the fewest false positives, at most 7 fits in 64 bits of hash
+    n_hashes = min(7, max(1, round(bits_per_kmer * math.log(2))))
+    bloom = BloomFilter(np.zeros(n_blocks * BLOOM_BLOCK_WORDS, dtype=np.uint64), n_hashes, bits_per_kmer, len(kmers))
+    bloom.add(kmers)
+    return bloom
+
+def write_bloom_filter(bloom_filename, bloom, kmer_length, digest):
+    '''Save the bloom filter next to an index file'''
+    with atomic_write(bloom_filename) as file:
+        file.write(BLOOM_HEADER.pack(BLOOM_MAGIC, bloom.bits_per_kmer, bloom.n_hashes, bloom.n_kmers,
+                                     bloom.n_blocks, kmer_length, digest))
+        file.write(bloom.words.astype("<u8").tobytes())
+
+def load_bloom_filter(bloom_filename, index, bits_per_kmer):
+    '''Return the bloom filter of the index (a NumpyKmerIndex of a MappedKmerIndex) saved in bloom_filename.
+       If the file is missing or was made for another index or bits per kmer it is made again.
+    '''
+    mapped_index = index.mapped_index
+    try:
+        with open(bloom_filename, "rb") as file:
+            (magic, bits, n_hashes, n_kmers, n_blocks, kmer_length, digest) = BLOOM_HEADER.unpack(file.read(BLOOM_HEADER.size))
+            if (magic, bits, n_kmers, kmer_length, digest) == (BLOOM_MAGIC, bits_per_kmer, len(index), mapped_index.kmer_length, mapped_index.digest):
+                words = np.fromfile(file, dtype="<u8", count=n_blocks * BLOOM_BLOCK_WORDS).astype(np.uint64)
+                if len(words) == n_blocks * BLOOM_BLOCK_WORDS:
+                    return BloomFilter(words, n_hashes, bits, n_kmers)
+    except (FileNotFoundError, struct.error):
+        pass
+    bloom = build_bloom_filter(index.kmers, bits_per_kmer)
+    write_bloom_filter(bloom_filename, bloom, mapped_index.kmer_length, mapped_index.digest)
+    return bloom
+
+def expand_ranges(starts, ends):
+    '''Return the numbers in all of the ranges [start, end) as one numpy array, and the lengths of the ranges'''
+    lengths = (ends - starts).astype(np.int64)
+    numbers = np.arange(lengths.sum(), dtype=np.int64)
+    numbers += np.repeat(starts.astype(np.int64) - (np.cumsum(lengths) - lengths), lengths)
+    return numbers, lengths
+
+def batch_canonical_kmers(dna_reads, kmer_length):
+    '''Return the canonical kmers of all the reads as flat numpy arrays: the kmers, their strands,
+       the number of the read and the position in the read of each kmer, and the offsets where the
+       kmers of each read start. The kmers of each read are in the order of encode_canonical_kmers.
+       The reads are packed into one buffer, and the kmers of every window are found at once
+       by shifting in the next base of all windows kmer_length times.
+    '''
+    lengths = np.fromiter(map(len, dna_reads), dtype=np.int64, count=len(dna_reads))
+    read_starts = np.cumsum(lengths) - lengths
+    packed = "".join(dna_reads).encode("latin-1") if dna_reads and isinstance(dna_reads[0], str) else b"".join(dna_reads)
+    codes = np.frombuffer(packed.translate(BASE2CODE), dtype=np.uint8)
+    n_windows = max(len(codes) - kmer_length + 1, 0)
+
+    # A window is a kmer if it is inside one read and has only ACGT bases
+    window_reads = np.repeat(np.arange(len(dna_reads)), lengths)[:n_windows]
+    window_positions = np.arange(n_windows) - read_starts[window_reads]
+    non_acgt_before = np.concatenate(([0], np.cumsum(codes > 3)))
+    starts = np.flatnonzero((window_positions <= lengths[window_reads] - kmer_length) &
+                            (non_acgt_before[kmer_length:] == non_acgt_before[:n_windows]))
+
+    # The kmer and its reverse complement of every window, the complement of a base is 3 - bits
+    bits = (codes & 3).astype(np.uint64)
+    kmers = np.zeros(n_windows, dtype=np.uint64)
+    reverse_kmers = np.zeros(n_windows, dtype=np.uint64)
+    for i in range(kmer_length):
+        base = bits[i: i + n_windows]
+        kmers <<= np.uint64(2)
+        kmers |= base
+        reverse_kmers |= (np.uint64(3) - base) << np.uint64(2 * i)
+    (kmers, reverse_kmers) = (kmers[starts], reverse_kmers[starts])
+
+    kmer_reads = window_reads[starts]
+    read_offsets = np.concatenate(([0], np.cumsum(np.bincount(kmer_reads, minlength=len(dna_reads)))))
+    return (np.minimum(kmers, reverse_kmers), (reverse_kmers < kmers).astype(np.uint8),
+            kmer_reads, window_positions[starts], read_offsets)
+
+def index_size(kmer2gene2kmerpos):
+    '''Return the number of kmers in the index and its size in bytes'''
+    if isinstance(kmer2gene2kmerpos, MappedKmerIndex):
+        return len(kmer2gene2kmerpos), len(kmer2gene2kmerpos.mapped)
+    if isinstance(kmer2gene2kmerpos, NumpyKmerIndex):
+        index = kmer2gene2kmerpos
+        if index.mapped_index is not None:
+            return len(index), len(index.mapped_index.mapped)
+        size = sum(values.nbytes for values in (index.kmers, index.posting_offsets, index.posting_genes,
+                                                index.posting_positions, index.gene_lengths))
+        return len(index), size + sys.getsizeof(index.genenames) + sum(map(sys.getsizeof, index.genenames))
+    if isinstance(kmer2gene2kmerpos, CompactKmerIndex):
+        index = kmer2gene2kmerpos
+        size = sys.getsizeof(index.kmer2posting) + sum(map(sys.getsizeof, index.kmer2posting))
+        size += sum(map(sys.getsizeof, index.kmer2posting.values()))
+        size += sys.getsizeof(index.genenames) + sum(map(sys.getsizeof, index.genenames))
+        for values in (index.gene_lengths, index.posting_offsets, index.posting_genes, index.posting_positions):
+            size += sys.getsizeof(values)
+        return len(index), size
+    size = sys.getsizeof(kmer2gene2kmerpos)
+    for kmer, gene2kmerpos in kmer2gene2kmerpos.items():
+        size += sys.getsizeof(kmer) + sys.getsizeof(gene2kmerpos)
+        size += sum(sys.getsizeof(kmerpos) for kmerpos in gene2kmerpos.values())
+    for dna in (getattr(kmer2gene2kmerpos, "gene2dna", None) or dict()).values():
+        size += sys.getsizeof(dna)
+    return len(kmer2gene2kmerpos), size
+
+# Odd multiplier scrambling the kmers, so minimizers are not biased towards poly-A kmers
+MINIMIZER_HASH = 0x9E3779B97F4A7C15
+KMER_FILTER_BITS = 16   # The bits per kmer of the filters of the kmers of each gene in a MinimizerIndex
+
+def minimizers(kmers, window, kmer_length):
+    '''Return the (window, kmer_length) minimizers of a list of kmers from
+       encode_canonical_kmers: the kmer with the smallest hash in each window
+       of window consecutive kmers (the leftmost if tied), each only once.
+       The end minimizers, of the shorter windows of the first and last 1 .. window-1 kmers,
+       are included, so a read overlapping the end of a gene by fewer than window kmers
+       still shares a minimizer with the gene.
+    '''
+    mask = (1 << 2 * kmer_length) - 1
+    chosen = []
+    # Indexes of kmers in the current window, with increasing hash
+    queue = deque()
+    for i, (kmer, _, _) in enumerate(kmers):
+        kmer_hash = (kmer * MINIMIZER_HASH) & mask
+        while queue and queue[-1][0] > kmer_hash:
+            queue.pop()
+        queue.append((kmer_hash, i))
+        if queue[0][1] <= i - window:
+            queue.popleft()
+        # The windows starting before the first kmer are the shorter windows at the start
+        if not chosen or chosen[-1] != queue[0][1]:
+            chosen.append(queue[0][1])
+
+    # The shorter windows at the end, the leftmost smallest of the last 1 .. window-1 kmers
+    smallest = None
+    for i in range(len(kmers) - 1, max(len(kmers) - window, -1), -1):
+        kmer_hash = (kmers[i][0] * MINIMIZER_HASH) & mask
+        if smallest is None or kmer_hash <= smallest[0]:
+            smallest = (kmer_hash, i)
+        chosen.append(smallest[1])
+    return [kmers[i] for i in sorted(set(chosen))]
+
+class MinimizerIndex(KmerIndex):
+    '''A sparse kmer2gene2kmerpos holding only the minimizers of the genes.
+       The gene sequences are kept in gene2dna to verify the coverage of a read,
+       and the genes with a kmer at more than one position in repeat_genes.
+       gene2filter has for each gene a bitset (shift, bits) with the bit of the top bits of the
+       minimizer hash of each kmer of the gene set, a read kmer with the bit not set is not in the gene.
+    '''
+    window = 1
+    gene2dna = None
+    repeat_genes = None
+    gene2filter = None
+
+def kmer_filter(kmers, kmer_length):
+    '''Return the bitset (shift, bits) of the kmers of a gene, with KMER_FILTER_BITS bits per kmer'''
+    filter_bits = min(2 * kmer_length, max(3, (len(kmers) * KMER_FILTER_BITS - 1).bit_length()))
+    shift = 2 * kmer_length - filter_bits
+    bits = bytearray(1 << filter_bits - 3)
+    mask = (1 << 2 * kmer_length) - 1
+    for kmer, _, _ in kmers:
+        kmer_hash = ((kmer * MINIMIZER_HASH) & mask) >> shift
+        bits[kmer_hash >> 3] |= 1 << (kmer_hash & 7)
+    return (shift, bits)
+
+def build_minimizer_index(gene_filename, kmer_length, window, stats=NO_STATS):
+    '''Read in the file with the antibiotic resistence genes and return a
+       MinimizerIndex with the (window, kmer_length) minimizers of the genes:
+       {canonical_kmer: {"gene_name": (kmer_position_in_gene, length_gene, strand)}}
+    '''
+    kmer2gene2kmerpos = MinimizerIndex()
+    kmer2gene2kmerpos.window = window
+    kmer2gene2kmerpos.gene2dna = dict()
+    kmer2gene2kmerpos.repeat_genes = set()
+    kmer2gene2kmerpos.gene2filter = dict()
+    for dna, header in stats.timed_iter("fasta_parse", read_fasta(gene_filename, as_bytes=True)):
+        kmer2gene2kmerpos.gene2dna[header] = dna
+        kmers = list(encode_canonical_kmers(dna, kmer_length))
+        if len(set(kmer for kmer, _, _ in kmers)) < len(kmers):
+            kmer2gene2kmerpos.repeat_genes.add(header)
+        kmer2gene2kmerpos.gene2filter[header] = kmer_filter(kmers, kmer_length)
+        for kmer, strand, kmer_pos_in_gene in minimizers(kmers, window, kmer_length):
             if kmer in kmer2gene2kmerpos:
-                kmer2gene2kmerpos[kmer][header] = (kmer_pos_in_gene, len(dna))
+                kmer2gene2kmerpos[kmer][header] = (kmer_pos_in_gene, len(dna), strand)
+            else:
+                kmer2gene2kmerpos[kmer] = {header : (kmer_pos_in_gene, len(dna), strand)}
+    kmer2gene2kmerpos.min_gene_length = min(map(len, kmer2gene2kmerpos.gene2dna.values()), default=0)
+    return kmer2gene2kmerpos
+
+def check_minimizer_window(kmer2gene2kmerpos, read_len, kmer_length):
+    '''Exit if the index is a MinimizerIndex with a window too large for reads of length read_len,
+       a valid read could then share no minimizer with its gene and be missed
+    '''
+    if isinstance(kmer2gene2kmerpos, MinimizerIndex):
+        max_window = max_minimizer_window(read_len, kmer_length, kmer2gene2kmerpos.min_gene_length)
+        if kmer2gene2kmerpos.window > max_window:
+            sys.exit(f"--minimizer {kmer2gene2kmerpos.window} is too large for the reads of {read_len} bases, "
+                     f"a read can be valid sharing only {max_window} kmers with a gene (use --minimizer {max_window} or less)")
+
+COMPLEMENT = bytes.maketrans(b"ACGT", b"TGCA")
+
+def diagonal_coverage(dna_read, dna_gene, diagonal, kmer_length):
+    '''Place the read on the gene with its first base at position diagonal,
+       and return the stretches (start, end) of the gene where at least
+       kmer_length bases in a row are equal to the read
+    '''
+    start = max(0, -diagonal)
+    end = min(len(dna_read), len(dna_gene) - diagonal)
+    stretches = []
+    run_start = start
+    for i in range(start, end):
+        if dna_read[i] != dna_gene[diagonal + i]:
+            if i - run_start >= kmer_length:
+                stretches.append((diagonal + run_start, diagonal + i))
+            run_start = i + 1
+    if end - run_start >= kmer_length:
+        stretches.append((diagonal + run_start, diagonal + end))
+    return stretches
+
+def minimizer_read_coverage(dna_read, kmer2gene2kmerpos, kmer_length):
+    '''Find the genes of a read from its minimizers in a MinimizerIndex, and
+       verify the coverage against the gene sequences.
+       Return {("gene_name", strand): (length_gene, stretches)} like the kmer scan in scan_reads,
+       with the same stretches as the full index when the window passes check_minimizer_window.
+    '''
+    if isinstance(dna_read, str):
+        dna_read = dna_read.encode("ascii")
+    reverse_read = dna_read.translate(COMPLEMENT)[::-1]
+    read_kmers = list(encode_canonical_kmers(dna_read, kmer_length))
+
+    # The placements (strand, diagonal) of the read on each gene sharing a minimizer with it
+    gene2placements = dict()
+    for kmer, read_strand, read_pos in minimizers(read_kmers, kmer2gene2kmerpos.window, kmer_length):
+        for genename, (kmer_pos, len_gene, gene_strand) in kmer2gene2kmerpos.get(kmer, dict()).items():
+            # A read on the other strand is placed reverse complemented on the gene
+            strand = read_strand ^ gene_strand
+            if strand:
+                diagonal = kmer_pos - (len(dna_read) - kmer_length - read_pos)
+            else:
+                diagonal = kmer_pos - read_pos
+            gene2placements.setdefault(genename, set()).add((strand, diagonal))
+
+    mask = (1 << 2 * kmer_length) - 1
+    read_hashes = [((kmer * MINIMIZER_HASH) & mask, read_pos) for kmer, _, read_pos in read_kmers]
+
+    READgene2hits = dict()
+    last_pos = len(dna_read) - kmer_length
+    for genename, placements in gene2placements.items():
+        dna_gene = kmer2gene2kmerpos.gene2dna[genename]
+        strand2hits = {0: [], 1: []}
+        # The kmers of a gene without repeats are found at the placements. A kmer at more than
+        # one position is found at its last position, as in the full index.
+        placed = set()   # The positions in the read of the kmers found at the placements
+        def place(strand, diagonal):
+            for start, end in diagonal_coverage(reverse_read if strand else dna_read, dna_gene, diagonal, kmer_length):
+                strand2hits[strand].append((start, end))
+                for read_pos in range(start - diagonal, end - diagonal - kmer_length + 1):
+                    placed.add(last_pos - read_pos if strand else read_pos)
+
+        repeats = genename in kmer2gene2kmerpos.repeat_genes
+        if not repeats:
+            for strand, diagonal in placements:
+                place(strand, diagonal)
+
+        # The other kmers of the read may be in the gene too, eg after an indel. In a gene
+        # without repeats such a kmer gives a new placement with the kmers following it.
+        (shift, bits) = kmer2gene2kmerpos.gene2filter[genename]
+        for kmer_hash, read_pos in read_hashes:
+            if read_pos in placed or not bits[kmer_hash >> shift >> 3] >> (kmer_hash >> shift & 7) & 1:
+                continue
+            position = dna_gene.rfind(dna_read[read_pos: read_pos + kmer_length])
+            reverse_position = dna_gene.rfind(reverse_read[last_pos - read_pos: last_pos - read_pos + kmer_length])
+            if position >= 0 and position >= reverse_position:
+                (strand, position, diagonal) = (0, position, position - read_pos)
+            elif reverse_position >= 0:
+                (strand, position, diagonal) = (1, reverse_position, reverse_position - (last_pos - read_pos))
             else:
-                kmer2gene2kmerpos[kmer] = {header : (kmer_pos_in_gene, len(dna))}
+                continue
+            if repeats:
+                strand2hits[strand].append((position, position + kmer_length))
+            else:
+                place(strand, diagonal)
+
+        for strand, hits in strand2hits.items():
+            if hits:
+                READgene2hits[(genename, strand)] = (len(dna_gene), hits)
+    return READgene2hits
 
+def read_gene_hits(dna_read, kmer2gene2kmerpos, kmer_length, min_hits, stats=NO_STATS):
+    '''Return the stretches of the genes covered by the kmers of the read as
+       {("gene_name", strand): (length_gene, stretches)}, or None if fewer than
+       min_hits of the kmers of the read can be in the genes
+    '''
+    # A minimizer index finds the genes from the minimizers of the read
+    if isinstance(kmer2gene2kmerpos, MinimizerIndex):
+        return minimizer_read_coverage(dna_read, kmer2gene2kmerpos, kmer_length)
+
+    # Skip the read if too few of its kmers are in the genes for it to be valid
+    read_kmers = list(encode_canonical_kmers(dna_read, kmer_length))
+    if stats.enabled:
+        stats.count("kmers", len(read_kmers))
+    if not probe_read(read_kmers, kmer2gene2kmerpos, kmer_length, min_hits):
+        return None
 
-# Read in the fastaq file, for each read evaluate if read is valid.
-# If valid, add it to total depht count for each gene saved in TOTALgene2depht_count
-TOTALgene2depht_count = dict()
-for dna_read in read_fastq(read_filename):
-    (kmer_list, _) = get_kmers_and_pos(dna_read, kmer_length)
+    # With the postings in flat arrays the hits are collected for each gene id,
+    # and the headers only looked up for the genes hit by the read
+    if isinstance(kmer2gene2kmerpos, PostingIndex):
+        index = kmer2gene2kmerpos
+        find_posting = index.kmer2posting.get if isinstance(index, (CompactKmerIndex, MappedKmerIndex)) else index.posting
+        (posting_offsets, posting_genes, posting_positions) = (index.posting_offsets, index.posting_genes, index.posting_positions)
+        READgene_id2hits = dict()
+        index_hits = 0
+        for kmer, read_strand, _ in read_kmers:
+            posting = find_posting(kmer)
+            if posting is not None:
+                index_hits += 1
+                posting_id = posting >> 32
+                # The base position, and the strand of the read relative to the base strand
+                base = posting & 0x7FFFFFFF
+                read_strand ^= posting >> 31 & 1
+                for i in range(posting_offsets[posting_id], posting_offsets[posting_id + 1]):
+                    position = posting_positions[i]
+                    gene_and_strand = (posting_genes[i], read_strand ^ (position >> 31))
+                    hits = READgene_id2hits.get(gene_and_strand)
+                    if hits is None:
+                        hits = READgene_id2hits[gene_and_strand] = []
+                    kmer_pos = base + (position & 0x7FFFFFFF)
+                    hits.append((kmer_pos, kmer_pos + kmer_length))
+        if stats.enabled:
+            stats.count("index_hits", index_hits)
+        return {(index.genename(gene_id), strand): (index.gene_lengths[gene_id], hits)
+                for (gene_id, strand), hits in READgene_id2hits.items()}
 
     # For all kmers check if they match a kmer in the gene
-    # If they match save where they covered the gene in the datastructure: "READgene2depht_count"
-    # where the depht_count is a list where 1 is matching position and 0 is non matching
-    READgene2depht_count = dict()
-    for kmer in kmer_list:
+    # If they match save the stretch (start, end) they covered of the gene in the
+    # datastructure: "READgene2hits" as {("gene_name", strand): (length_gene, stretches)}
+    # The stretches are kept for each gene and strand of the read relative to the gene,
+    # the positions are always on the strand given in the gene file.
+    READgene2hits = dict()
+    index_hits = 0
+    for kmer, read_strand, _ in read_kmers:
         # If the kmer is equal to a kmer in the genes
-        if kmer in kmer2gene2kmerpos:
-            # Go through each gene which has the kmer and add depht to it.
-            for genename in kmer2gene2kmerpos[kmer]:
-                len_gene = kmer2gene2kmerpos[kmer][genename][1]
-                kmer_pos = kmer2gene2kmerpos[kmer][genename][0]
-                if genename not in READgene2depht_count:
-                    # Make vector of [0] to represent depht of each nt corresponding to length of gene
-                    READgene2depht_count[genename] = [0] * len_gene
-                # Add depht to it, corresponding the kmer found
-                for i in range(kmer_pos, kmer_pos + kmer_length):
-                    READgene2depht_count[genename][i] = 1
-    
-    # If the read is valid, add the gene to the final depht_count for each gene (FINALgene2depht_count)
-    for genename, depht_count in READgene2depht_count.items():
-        if read_is_valid(depht_count, dna_read):
-            if genename in TOTALgene2depht_count:
-                # elementwise addition
-                for i in range(len(TOTALgene2depht_count[genename])):
-                    TOTALgene2depht_count[genename][i] += depht_count[i]    
-            else :
-                TOTALgene2depht_count[genename] = depht_count
-
-
-# Calculate coverage, min depht and avg coverage based on depht_counts from TOTALgene2depht_count
-# Add genes with coverage > 95 percent and min_depht >10 gene2coverage_depht
-gene2coverage_depht = dict()
-for genename, dna in TOTALgene2depht_count.items():
-    (coverage, avg_depht, min_depht) = coverage_stats(dna)
-    if coverage > 0.95 and min_depht > 10:
-        gene2coverage_depht[genename] = (coverage, avg_depht)
-
-# sort the genes based on coverage then depht
-sorted_gene_coverage_depht = sorted(
-            gene2coverage_depht, 
-            key= gene2coverage_depht.get, 
-            reverse = True)
-
-# output and format sorted_gene_coverage_depht to tab seperated format
-print("gene\tresistence\tcoverage\tavg_depht")
-for genename in sorted_gene_coverage_depht:
-    coverage = round(gene2coverage_depht[genename][0],2)
-    avg_depht = round(gene2coverage_depht[genename][1],2)
-    (gene,resistence) = genename.split(maxsplit = 1)
-    gene = gene[1:]
-    print(f"{gene}\t{resistence}\t{coverage}\t{avg_depht}")
+        gene2kmerpos = kmer2gene2kmerpos.get(kmer)
+        if gene2kmerpos is not None:
+            index_hits += 1
+            # Go through each gene which has the kmer and add the stretch to it.
+            for genename, (kmer_pos, len_gene, gene_strand) in gene2kmerpos.items():
+                gene_and_strand = (genename, read_strand ^ gene_strand)
+                if gene_and_strand not in READgene2hits:
+                    READgene2hits[gene_and_strand] = (len_gene, [])
+                READgene2hits[gene_and_strand][1].append((kmer_pos, kmer_pos + kmer_length))
+    if stats.enabled:
+        stats.count("index_hits", index_hits)
+    return READgene2hits
+
+def scan_reads(reads, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats=NO_STATS):
+    '''For each read evaluate if read is valid.
+       If valid, add it to total depht count for each gene in TOTALgene2depht_count
+       (DephtCounts or NumpyDephtCounts) and return it
+    '''
+    # The sorted array index looks up the kmers of many reads at a time
+    if isinstance(kmer2gene2kmerpos, NumpyKmerIndex):
+        return scan_reads_csr(reads, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats)
+
+    def min_hits(read_len):
+        if read_len not in read_len2min_hits:
+            read_len2min_hits[read_len] = min_kmer_hits(read_len, kmer_length, kmer2gene2kmerpos.min_gene_length)
+            check_minimizer_window(kmer2gene2kmerpos, read_len, kmer_length)
+        return read_len2min_hits[read_len]
+    read_len2min_hits = dict()
+
+    # Without stats the reads are scanned in a loop without the stages and counters,
+    # which cost a lot for each read and gene even when they do nothing
+    if not stats.enabled:
+        for dna_read in reads:
+            READgene2hits = read_gene_hits(dna_read, kmer2gene2kmerpos, kmer_length, min_hits(len(dna_read)))
+            if READgene2hits is None:
+                continue
+            for (genename, _), (len_gene, hits) in READgene2hits.items():
+                intervals = merge_intervals(hits)
+                if read_is_valid(intervals, len_gene, dna_read):
+                    TOTALgene2depht_count.add(genename, intervals, len_gene)
+        return TOTALgene2depht_count
+
+    for dna_read in reads:
+        stats.count("reads")
+        stats.enter("kmer_lookup")
+        READgene2hits = read_gene_hits(dna_read, kmer2gene2kmerpos, kmer_length, min_hits(len(dna_read)), stats)
+        stats.exit()
+        if READgene2hits is None:
+            continue
+
+        # If the read is valid, add the stretches it covers to the final depht_count for each gene (TOTALgene2depht_count)
+        for (genename, _), (len_gene, hits) in READgene2hits.items():
+            stats.enter("read_is_valid")
+            intervals = merge_intervals(hits)
+            valid = read_is_valid(intervals, len_gene, dna_read)
+            stats.exit()
+            if valid:
+                stats.valid_read(genename)
+                stats.enter("accumulation")
+                TOTALgene2depht_count.add(genename, intervals, len_gene)
+                stats.exit()
+    return TOTALgene2depht_count
+
+def scan_fragments(fragments, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats=NO_STATS):
+    '''Like scan_reads, but for the (mate1, mate2) reads of paired-end fragments.
+       When both mates hit the same gene, the coverage is evaluated for the fragment
+       (fragment_is_valid) and the stretches covered by the fragment are counted once.
+       The mates of a fragment are on opposite strands, so mate2 hits the gene on the
+       opposite strand of mate1.
+    '''
+    # The sorted array index looks up the kmers of many fragments at a time
+    if isinstance(kmer2gene2kmerpos, NumpyKmerIndex):
+        return scan_fragments_csr(fragments, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats)
+
+    for mate1, mate2 in fragments:
+        stats.count("reads", 2)
+        # No prefilter, a mate with few hits can still make the fragment valid
+        stats.enter("kmer_lookup")
+        MATE1gene2hits = read_gene_hits(mate1, kmer2gene2kmerpos, kmer_length, 1, stats) or dict()
+        MATE2gene2hits = read_gene_hits(mate2, kmer2gene2kmerpos, kmer_length, 1, stats) or dict()
+        stats.exit()
+        add_fragment(mate1, mate2, MATE1gene2hits, MATE2gene2hits, TOTALgene2depht_count, stats)
+    return TOTALgene2depht_count
+
+def add_fragment(mate1, mate2, MATE1gene2hits, MATE2gene2hits, TOTALgene2depht_count, stats=NO_STATS):
+    '''Evaluate the hits of the mates of a fragment, {("gene_name", strand): (length_gene, stretches)},
+       and add the stretches covered by the fragment to TOTALgene2depht_count for each gene it is valid for
+    '''
+    for (genename, strand), (len_gene, hits) in MATE1gene2hits.items():
+        stats.enter("read_is_valid")
+        intervals = merge_intervals(hits)
+        mate2_hits = MATE2gene2hits.pop((genename, strand ^ 1), None)
+        if mate2_hits is None:
+            valid = read_is_valid(intervals, len_gene, mate1)
+        else:
+            intervals2 = merge_intervals(mate2_hits[1])
+            valid = fragment_is_valid(intervals, intervals2, len_gene, len(mate1), len(mate2))
+            intervals = merge_intervals(intervals + intervals2)
+        stats.exit()
+        if valid:
+            stats.valid_read(genename)
+            stats.enter("accumulation")
+            TOTALgene2depht_count.add(genename, intervals, len_gene)
+            stats.exit()
+
+    # The genes only hit by mate2
+    for (genename, _), (len_gene, hits) in MATE2gene2hits.items():
+        stats.enter("read_is_valid")
+        intervals = merge_intervals(hits)
+        valid = read_is_valid(intervals, len_gene, mate2)
+        stats.exit()
+        if valid:
+            stats.valid_read(genename)
+            stats.enter("accumulation")
+            TOTALgene2depht_count.add(genename, intervals, len_gene)
+            stats.exit()
+
+CSR_BATCH_SIZE = 1 << 12   # The number of reads looked up at a time in a NumpyKmerIndex
+CSR_MAX_POSTINGS = 1 << 20   # The number of postings of the kmers found expanded to hits at a time
+
+def scan_reads_csr(reads, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats=NO_STATS):
+    '''Like scan_reads, for a NumpyKmerIndex. The reads are scanned in batches of CSR_BATCH_SIZE,
+       the kmers of all reads in a batch are found with one np.searchsorted, and only
+       the hits are expanded to the stretches of the genes covered by each read,
+       up to CSR_MAX_POSTINGS postings at a time.
+    '''
+    batch = []
+    for dna_read in reads:
+        batch.append(dna_read)
+        if len(batch) == CSR_BATCH_SIZE:
+            _scan_csr_batch(batch, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats)
+            batch = []
+    if batch:
+        _scan_csr_batch(batch, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats)
+    return TOTALgene2depht_count
+
+def scan_fragments_csr(fragments, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats=NO_STATS):
+    '''Like scan_fragments, for a NumpyKmerIndex. The kmers of both mates of CSR_BATCH_SIZE // 2
+       fragments are looked up at a time with csr_batch_hits.
+    '''
+    batch = []
+    for fragment in fragments:
+        batch.append(fragment)
+        if len(batch) == CSR_BATCH_SIZE // 2:
+            _scan_csr_fragment_batch(batch, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats)
+            batch = []
+    if batch:
+        _scan_csr_fragment_batch(batch, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats)
+    return TOTALgene2depht_count
+
+def _scan_csr_fragment_batch(fragments, index, kmer_length, TOTALgene2depht_count, stats):
+    # The mates 1 are reads 0 .. n-1 of the batch and the mates 2 reads n .. 2n-1.
+    # No prefilter, a mate with few hits can still make the fragment valid.
+    mates = [mate1 for mate1, _ in fragments] + [mate2 for _, mate2 in fragments]
+    gene_lengths = index.gene_lengths.tolist()
+    FRAGMENTgene2hits = [(dict(), dict()) for _ in fragments]
+    for read_id, gene_id, strand, intervals in csr_batch_hits(mates, index, kmer_length, stats, prefilter=False):
+        (mate, fragment_id) = divmod(read_id, len(fragments))
+        FRAGMENTgene2hits[fragment_id][mate][(index.genename(gene_id), strand)] = (gene_lengths[gene_id], intervals)
+    for (mate1, mate2), (MATE1gene2hits, MATE2gene2hits) in zip(fragments, FRAGMENTgene2hits):
+        if MATE1gene2hits or MATE2gene2hits:
+            add_fragment(mate1, mate2, MATE1gene2hits, MATE2gene2hits, TOTALgene2depht_count, stats)
+
+def _scan_csr_batch(dna_reads, index, kmer_length, TOTALgene2depht_count, stats):
+    # If the read is valid, add the stretches it covers to the final depht_count for each gene (TOTALgene2depht_count)
+    gene_lengths = index.gene_lengths.tolist()
+    for read_id, gene_id, _, intervals in csr_batch_hits(dna_reads, index, kmer_length, stats):
+        stats.enter("read_is_valid")
+        len_gene = gene_lengths[gene_id]
+        valid = read_is_valid(intervals, len_gene, dna_reads[read_id])
+        stats.exit()
+        if valid:
+            genename = index.genename(gene_id)
+            stats.valid_read(genename)
+            stats.enter("accumulation")
+            TOTALgene2depht_count.add(genename, intervals, len_gene)
+            stats.exit()
+
+def csr_batch_hits(dna_reads, index, kmer_length, stats=NO_STATS, prefilter=True):
+    '''Yield the stretches of the genes covered by the kmers of each read in a batch, looked up in
+       a NumpyKmerIndex at once, as (read_id, gene_id, strand, stretches) sorted on read, gene and strand.
+       With prefilter the reads with too few kmers in the genes to be valid are skipped.
+       The kmers found are expanded to their postings for the reads of up to CSR_MAX_POSTINGS
+       postings at a time, so a batch of reads from a large gene family does not hold all its hits at once.
+    '''
+    stats.count("reads", len(dna_reads))
+    stats.enter("kmer_lookup")
+    # The kmers of all reads after each other, the read of each kmer, and where the kmers of each read starts
+    (kmers, strands, kmer_reads, _, read_offsets) = batch_canonical_kmers(dna_reads, kmer_length)
+    stats.count("kmers", len(kmers))
+    if not len(kmers) or not len(index.kmers):
+        stats.exit()
+        return
+
+    # Find all kmers in the index at once. With a bloom filter only the kmers
+    # passing the filter are looked up.
+    if index.bloom is not None:
+        maybe = np.flatnonzero(index.bloom.contains(kmers))
+        rows = np.zeros(len(kmers), dtype=np.int64)
+        rows[maybe] = np.searchsorted(index.kmers, kmers[maybe])
+        np.minimum(rows, len(index.kmers) - 1, out=rows)
+        found = np.zeros(len(kmers), dtype=bool)
+        found[maybe] = index.kmers[rows[maybe]] == kmers[maybe]
+        n_found = int(found.sum())
+        stats.count("bloom_false_positives", len(maybe) - n_found)
+        stats.count("bloom_true_negatives", len(kmers) - n_found - (len(maybe) - n_found))
+    else:
+        rows = np.searchsorted(index.kmers, kmers)
+        np.minimum(rows, len(index.kmers) - 1, out=rows)
+        found = index.kmers[rows] == kmers
+
+    # Skip the reads with too few kmers in the genes to be valid, as the prefilter of scan_reads
+    if prefilter:
+        found_before = np.concatenate(([0], np.cumsum(found)))
+        read_hits = found_before[read_offsets[1:]] - found_before[read_offsets[:-1]]
+        (read_lengths, length_ids) = np.unique(np.fromiter(map(len, dna_reads), dtype=np.int64, count=len(dna_reads)),
+                                               return_inverse=True)
+        min_hits = np.array([min_kmer_hits(read_len, kmer_length, index.min_gene_length)
+                             for read_len in read_lengths.tolist()], dtype=np.int64)[length_ids]
+        passing = read_hits >= min_hits
+        stats.count("index_hits", int(read_hits[passing].sum()))
+        keep = found & passing[kmer_reads]
+    else:
+        stats.count("index_hits", int(found.sum()))
+        keep = found
+    (rows, kmer_reads, strands) = (rows[keep], kmer_reads[keep], strands[keep])
+    # The number of postings up to and including each kmer found
+    posting_ends = np.cumsum((index.posting_offsets[rows + 1] - index.posting_offsets[rows]).astype(np.int64))
+    stats.exit()
+
+    # Expand the kmers of whole reads up to CSR_MAX_POSTINGS postings at a time,
+    # a read with more postings is expanded on its own
+    start = 0
+    while start < len(rows):
+        stats.enter("kmer_lookup")
+        end = int(np.searchsorted(posting_ends, (posting_ends[start - 1] if start else 0) + CSR_MAX_POSTINGS, side="right"))
+        if end < len(rows):
+            end = int(np.searchsorted(kmer_reads, kmer_reads[end], side="left"))
+            if end <= start:
+                end = int(np.searchsorted(kmer_reads, kmer_reads[start], side="right"))
+        hits = _expand_csr_hits(rows[start:end], kmer_reads[start:end], strands[start:end], index, kmer_length)
+        stats.exit()
+        yield from hits
+        start = end
+
+def _expand_csr_hits(rows, kmer_reads, strands, index, kmer_length):
+    '''Return the hits of the kmers found at rows of a NumpyKmerIndex, as csr_batch_hits'''
+    # Expand the kmers found to their postings: the read, gene, strand of the read relative to the gene and position
+    (postings, lengths) = expand_ranges(index.posting_offsets[rows], index.posting_offsets[rows + 1])
+    hit_reads = np.repeat(kmer_reads, lengths)
+    hit_genes = index.posting_genes[postings].astype(np.int64)
+    positions = index.posting_positions[postings]
+    hit_strands = np.repeat(strands, lengths) ^ (positions >> 31).astype(np.uint8)
+    hit_positions = (positions & 0x7FFFFFFF).astype(np.int64)
+
+    # Sort the hits of each read, gene and strand on position, and merge the
+    # overlapping or adjacent kmers to stretches as merge_intervals
+    order = np.lexsort((hit_positions, hit_strands, hit_genes, hit_reads))
+    (hit_reads, hit_genes, hit_strands, hit_positions) = (hit_reads[order], hit_genes[order], hit_strands[order], hit_positions[order])
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = (hit_reads[1:] != hit_reads[:-1]) | (hit_genes[1:] != hit_genes[:-1]) | (hit_strands[1:] != hit_strands[:-1])
+    new_stretch = new_group.copy()
+    new_stretch[1:] |= hit_positions[1:] > hit_positions[:-1] + kmer_length
+    stretch_starts = np.flatnonzero(new_stretch)
+    stretch_ends = np.append(stretch_starts[1:], len(order)) - 1
+    starts = hit_positions[stretch_starts].tolist()
+    ends = (hit_positions[stretch_ends] + kmer_length).tolist()
+    # The first stretch of each group
+    group_stretches = np.flatnonzero(new_group[stretch_starts]).tolist() + [len(starts)]
+    group_hits = stretch_starts[group_stretches[:-1]]
+    group_reads = hit_reads[group_hits].tolist()
+    group_genes = hit_genes[group_hits].tolist()
+    group_strands = hit_strands[group_hits].tolist()
+    return [(read_id, gene_id, strand, list(zip(starts[group_stretches[i]: group_stretches[i + 1]],
+                                                ends[group_stretches[i]: group_stretches[i + 1]])))
+            for i, (read_id, gene_id, strand) in enumerate(zip(group_reads, group_genes, group_strands))]
+
+# The index, kmer length, type of depht counts, if stats are kept, the scan function
+# (scan_reads or scan_fragments) and if the scans are profiled used by the worker processes of scan_reads_parallel
+worker_index = None
+worker_kmer_length = None
+worker_depht_counts = None
+worker_stats = False
+worker_scan = scan_reads
+worker_profile = False
+
+def _init_worker(kmer2gene2kmerpos, kmer_length, depht_counts, stats_enabled, scan=scan_reads, profile=False):
+    global worker_index, worker_kmer_length, worker_depht_counts, worker_stats, worker_scan, worker_profile
+    worker_index = kmer2gene2kmerpos
+    worker_kmer_length = kmer_length
+    worker_depht_counts = depht_counts
+    worker_stats = stats_enabled
+    worker_scan = scan
+    worker_profile = profile
+
+def _scan_batch(reads):
+    stats = Stats(worker_stats)
+    profile = cProfile.Profile() if worker_profile else None
+    if profile is not None:
+        profile.enable()
+    # A worker which exits is never replied by, the pool would wait for it forever.
+    # The exit is sent back in place of the depht counts, and the main process exits with it.
+    try:
+        with stats.stage("read_scan"):
+            PARTgene2depht_count = worker_scan(reads, worker_index, worker_kmer_length, worker_depht_counts(), stats)
+    except SystemExit as error:
+        PARTgene2depht_count = error
+    if profile is not None:
+        profile.disable()
+        stats.worker_profiles.append(pstats.Stats(profile).stats)
+    return PARTgene2depht_count, stats
+
+def worker_pool(kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, threads, stats=NO_STATS, scan=scan_reads):
+    '''Return a pool of threads worker processes for scan_reads_parallel, with the index and
+       the type of TOTALgene2depht_count set up in each worker
+    '''
+    return multiprocessing.Pool(threads, initializer=_init_worker,
+                                initargs=(kmer2gene2kmerpos, kmer_length, type(TOTALgene2depht_count), stats.enabled,
+                                          scan, stats.profile_workers))
+
+def scan_reads_parallel(read_batches, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, threads, stats=NO_STATS,
+                        scan=scan_reads, pool=None):
+    '''Like scan_reads, but the batches of reads (eg from read_fastq_batches) are
+       scanned by a pool of worker processes. The partial depht counts are merged
+       in the order of the batches, so the result is the same as from scan_reads.
+       The times of the stages in the workers are added up in stats, and with stats.profile_workers
+       the profiles of the scans in the workers are collected in stats.worker_profiles.
+       With scan=scan_fragments the batches are of (mate1, mate2) fragments.
+       A pool from worker_pool can be given to scan several parts of a sample with the same workers,
+       else a pool is made for the scan.
+    '''
+    def merge_next():
+        PARTgene2depht_count, worker_stats = pending.popleft().get()
+        if isinstance(PARTgene2depht_count, SystemExit):
+            sys.exit(PARTgene2depht_count.code)
+        TOTALgene2depht_count.merge(PARTgene2depht_count)
+        stats.merge(worker_stats)
+
+    # Only keep a few batches per worker in memory at a time
+    pending = deque()
+    with nullcontext(pool) if pool is not None else worker_pool(kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count,
+                                                               threads, stats, scan) as pool:
+        for batch in read_batches:
+            pending.append(pool.apply_async(_scan_batch, (batch,)))
+            if len(pending) >= 2 * threads:
+                merge_next()
+        while pending:
+            merge_next()
+    return TOTALgene2depht_count
+
+def write_stats(stats, kmer2gene2kmerpos, filename=None):
+    '''Write the stats of the run, the size of the index and the peak memory
+       as JSON to the file, or to stderr if no filename is given
+    '''
+    report = stats.report()
+    (n_kmers, n_bytes) = index_size(kmer2gene2kmerpos)
+    report["index"] = {"kmers": n_kmers, "bytes": n_bytes,
+                       "bytes_per_kmer": n_bytes / n_kmers if n_kmers else None}
+    if isinstance(kmer2gene2kmerpos, PostingIndex):
+        report["index"]["posting_lists"] = len(kmer2gene2kmerpos.posting_offsets) - 1
+    # The expected false positive rate of the bloom filter, and the rate seen in the read kmers
+    bloom = getattr(kmer2gene2kmerpos, "bloom", None)
+    if bloom is not None:
+        counters = report["counters"]
+        negatives = counters.get("bloom_false_positives", 0) + counters.get("bloom_true_negatives", 0)
+        report["index"]["bloom"] = {"bytes": bloom.words.nbytes, "bits_per_kmer": bloom.bits_per_kmer,
+                                    "hashes": bloom.n_hashes, "expected_fpr": bloom.expected_fpr(),
+                                    "measured_fpr": counters.get("bloom_false_positives", 0) / negatives if negatives else None}
+    # The peak of the memory allocated by python is only known with --trace-memory
+    if tracemalloc.is_tracing():
+        report["peak_traced_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+    # Linux reports kilobytes, macOS bytes
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report["peak_rss_bytes"] = maxrss if sys.platform == "darwin" else maxrss * 1024
+
+    if filename is None:
+        print(json.dumps(report, indent=2), file=sys.stderr)
+    else:
+        with open(filename, "w") as file:
+            file.write(json.dumps(report, indent=2) + "\n")
+
+def select_index(options, stats=NO_STATS):
+    '''Return the index asked for in the options from argument_parser:
+       the prebuilt index if given with --index, a minimizer index with
+       --minimizer W, else kmer2gene2kmerpos built from the gene file.
+       With --csr the index is made a NumpyKmerIndex, and with --bloom B it gets a bloom filter
+       with B bits per kmer, saved next to the --index file.
+    '''
+    (kmer_length, gene_filename) = (options["-k"], options["-g"])
+    if options["--minimizer"] > 0:
+        if options["--index"] is not None or options["--csr"]:
+            sys.exit("A minimizer index can not be used with --index or --csr")
+        # A mate sharing only a few kmers with the gene can make a fragment valid, they are only found with all kmers
+        if options.get("--fragment") and options["--minimizer"] > 1:
+            sys.exit("--fragment can only be used with --minimizer 1, a mate sharing a few kmers with a gene can make the fragment valid")
+        with stats.stage("index_build"):
+            return build_minimizer_index(gene_filename, kmer_length, options["--minimizer"], stats)
+    elif options["--index"] is not None:
+        with stats.stage("index_load"):
+            index = load_index(options["--index"], gene_filename, kmer_length, options["-t"])
+            # The dict of the kmers is made here once, the processes forked for -t, --serve
+            # and --checkpoint share it instead of each making it at their first lookup
+            if not options["--csr"]:
+                index.kmer2posting
+    else:
+        with stats.stage("index_build"):
+            index = build_index(gene_filename, kmer_length, stats, options["-t"])
+    if options["--bloom"] > 0 and not options["--csr"]:
+        sys.exit("The bloom filter is used by the sorted array index, --bloom needs --csr")
+    if options["--csr"]:
+        with stats.stage("index_load"):
+            index = NumpyKmerIndex(index)
+        if options["--bloom"] > 0:
+            with stats.stage("bloom_build"):
+                if options["--index"] is not None:
+                    index.bloom = load_bloom_filter(options["--index"] + ".bloom", index, options["--bloom"])
+                else:
+                    index.bloom = build_bloom_filter(index.kmers, options["--bloom"])
+    return index
+
+def scan_with_checkpoints(read_batches, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, checkpoint_filename,
+                          every, metadata, threads=1, stats=NO_STATS, scan=scan_reads):
+    '''Like scan_sample, adding to TOTALgene2depht_count, but every "every" reads the depht counts are saved
+       to the depht profile checkpoint_filename with the metadata, updated with the number of reads scanned (reads_done).
+       The first metadata["reads_done"] reads are skipped, they were scanned before the scan was resumed.
+       With scan=scan_fragments the batches are of (mate1, mate2) fragments and each fragment is one read.
+    '''
+    batches = iter(stats.timed_iter("fastq_parse", read_batches))
+    carry = []   # The rest of a batch split at a checkpoint
+    reads_done = metadata.get("reads_done", 0)
+
+    # Skip the reads scanned before
+    to_skip = reads_done
+    while to_skip > 0:
+        batch = next(batches, None)
+        if batch is None:
+            sys.exit(f"The reads ended after {reads_done - to_skip} reads, the checkpoint was at {reads_done} reads")
+        if len(batch) > to_skip:
+            carry.append(batch[to_skip:])
+        to_skip -= min(to_skip, len(batch))
+
+    def interval():
+        '''Yield the batches of the next "every" reads'''
+        nonlocal reads_done
+        n_reads = 0
+        while n_reads < every:
+            batch = carry.pop() if carry else next(batches, None)
+            if batch is None:
+                return
+            if n_reads + len(batch) > every:
+                carry.append(batch[every - n_reads:])
+                batch = batch[:every - n_reads]
+            n_reads += len(batch)
+            reads_done += len(batch)
+            yield batch
+
+    # The worker processes are started once, and scan the batches of each interval
+    with worker_pool(kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, threads, stats, scan) if threads > 1 else nullcontext() as pool:
+        while True:
+            last_reads_done = reads_done
+            with stats.stage("read_scan"):
+                if threads > 1:
+                    scan_reads_parallel(interval(), kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, threads, stats, scan, pool)
+                else:
+                    reads = (dna_read for dna_reads in interval() for dna_read in dna_reads)
+                    scan(reads, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats)
+            complete = reads_done - last_reads_done < every
+            metadata.update(reads_done=reads_done, complete=complete)
+            with stats.stage("checkpoint"):
+                write_depht_profile(checkpoint_filename, TOTALgene2depht_count, metadata)
+            if complete:
+                return TOTALgene2depht_count
+
+def counted_batches(read_batches, metadata):
+    '''Yield the batches of reads, adding the number of reads to metadata["reads_done"]'''
+    for batch in read_batches:
+        metadata["reads_done"] += len(batch)
+        yield batch
+
+def scan_sample(read_batches, kmer2gene2kmerpos, kmer_length, use_numpy=False, threads=1, stats=NO_STATS, scan=scan_reads):
+    '''Read in the batches of reads (eg from read_fastq_batches), for each read evaluate if read is valid.
+       If valid, add it to total depht count for each gene and return them (TOTALgene2depht_count).
+       With use_numpy the depht of all genes is kept in one numpy array.
+       With scan=scan_fragments the batches are of (mate1, mate2) fragments (eg from paired_batches).
+    '''
+    TOTALgene2depht_count = NumpyDephtCounts() if use_numpy else DephtCounts()
+    read_batches = stats.timed_iter("fastq_parse", read_batches)
+    with stats.stage("read_scan"):
+        if threads > 1:
+            scan_reads_parallel(read_batches, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, threads, stats, scan)
+        else:
+            reads = (dna_read for dna_reads in read_batches for dna_read in dna_reads)
+            scan(reads, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats)
+    return TOTALgene2depht_count
+
+def called_genes(TOTALgene2depht_count, min_coverage=0.95, min_depht=10, stats=NO_STATS):
+    '''Return [(gene, resistence, coverage, avg_depht)] for the genes with coverage > min_coverage
+       and min depht > min_depht, sorted on coverage then depht
+    '''
+    # Calculate coverage, min depht and avg coverage based on depht_counts from TOTALgene2depht_count
+    with stats.stage("coverage_stats"):
+        gene2stats = TOTALgene2depht_count.coverage_stats()
+    return select_genes(gene2stats, min_coverage, min_depht)
+
+# The orders the called genes can be sorted in, as a key on (genename, (coverage, avg_depht, min_depht))
+# and if the order is descending
+SORT_ORDERS = {
+    "coverage": (lambda item: (item[1][0], item[1][1]), True),
+    "depht": (lambda item: (item[1][1], item[1][0]), True),
+    "min_depht": (lambda item: (item[1][2], item[1][0], item[1][1]), True),
+    "name": (lambda item: split_genename(item[0]), False)}
+
+def select_genes(gene2stats, min_coverage=0.95, min_depht=10, sort_by="coverage"):
+    '''Like called_genes, but from the (coverage, avg_depht, min_depht) of each gene in gene2stats.
+       The genes are sorted on sort_by, one of SORT_ORDERS.
+    '''
+    # Add genes with enough coverage and min_depht to gene2coverage_depht
+    gene2coverage_depht = dict()
+    for genename, (coverage, avg_depht, min_depht_gene) in gene2stats.items():
+        if coverage > min_coverage and min_depht_gene > min_depht:
+            gene2coverage_depht[genename] = (coverage, avg_depht, min_depht_gene)
+
+    # sort the genes based on coverage then depht
+    (key, descending) = SORT_ORDERS[sort_by]
+    sorted_gene_coverage_depht = [genename for genename, _ in sorted(
+                gene2coverage_depht.items(),
+                key= key,
+                reverse = descending)]
+
+    genes = []
+    for genename in sorted_gene_coverage_depht:
+        coverage = round(gene2coverage_depht[genename][0],2)
+        avg_depht = round(gene2coverage_depht[genename][1],2)
+        (gene,resistence) = split_genename(genename)
+        genes.append((gene, resistence, coverage, avg_depht))
+    return genes
+
+@lru_cache(maxsize=None)
+def split_genename(genename):
+    '''Split a fasta header in the gene name (without ">") and the resistence, which is empty
+       if the header has none. Each header is only split once, the split is cached.
+    '''
+    (gene,resistence) = (genename[1:].split(maxsplit = 1) + [""])[:2]
+    return gene, resistence
+
+def format_tsv(genes, fraction_read=None):
+    '''Format the genes from called_genes to tab seperated format.
+       If only a fraction of the reads were read (scan_until_converged), the avg depht
+       extrapolated to all the reads is added as the last column.
+    '''
+    lines = ["gene\tresistence\tcoverage\tavg_depht"]
+    if fraction_read is not None:
+        lines[0] += "\textrapolated_avg_depht"
+    for gene, resistence, coverage, avg_depht in genes:
+        line = f"{gene}\t{resistence}\t{coverage}\t{avg_depht}"
+        if fraction_read is not None:
+            line += f"\t{round(avg_depht / fraction_read, 2)}"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+def scan_until_converged(read_filename, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, check_every,
+                         stable_checks=3, margin=0, min_coverage=0.95, min_depht=10, stats=NO_STATS):
+    '''Scan the reads in the fastq file, and every check_every reads find the called genes.
+       Stop when the same genes with the same coverage have been called in stable_checks checks
+       in a row, or (if margin is given) when every called gene has a min depht above margin * min_depht.
+       No genes called is never considered converged.
+       Return the number of reads scanned and the estimated fraction of the reads in the file it is,
+       which is None when reading from stdin ("-").
+    '''
+    if read_filename == "-":
+        (sample_file, file_size) = (sys.stdin.buffer, None)
+    else:
+        try: sample_file = open(read_filename, "rb")
+        except FileNotFoundError as errormessage:
+            sys.exit(f"The file '{read_filename}' could not be found, error: {errormessage}")
+        file_size = os.fstat(sample_file.fileno()).st_size
+    (n_reads, n_parsed) = (0, 0)
+    (last_calls, stable) = (None, 0)
+    with sample_file if file_size is not None else nullcontext():
+        for dna_reads in stats.timed_iter("fastq_parse", read_fastq_batches(read_filename, fileobj=sample_file)):
+            n_parsed += len(dna_reads)
+            i = 0
+            while i < len(dna_reads):
+                # Scan up to the next check
+                take = min(len(dna_reads) - i, check_every - n_reads % check_every)
+                with stats.stage("read_scan"):
+                    scan_reads(dna_reads[i: i + take], kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, stats)
+                (i, n_reads) = (i + take, n_reads + take)
+                if n_reads % check_every:
+                    continue
+
+                with stats.stage("coverage_stats"):
+                    gene2stats = TOTALgene2depht_count.coverage_stats()
+                calls = {genename: round(coverage, 2) for genename, (coverage, _, min_depht_gene) in gene2stats.items()
+                         if coverage > min_coverage and min_depht_gene > min_depht}
+                stable = stable + 1 if calls == last_calls else 1
+                last_calls = calls
+                clear = margin > 0 and all(gene2stats[genename][2] > margin * min_depht for genename in calls)
+                if calls and (stable >= stable_checks or clear):
+                    if file_size is None:
+                        return n_reads, None
+                    # The file position is ahead of the reads scanned by the rest of the parsed reads
+                    return n_reads, min(1.0, sample_file.tell() / file_size * n_reads / n_parsed)
+    return n_reads, 1.0
+
+def read_manifest(manifest_filename):
+    '''Return the fastq files listed in a manifest file, one per line.
+       A line may also give the sample name first, tab seperated from the file.
+       Empty lines and lines starting with # are skipped.
+    '''
+    try: manifest = open(manifest_filename)
+    except FileNotFoundError as errormessage:
+        sys.exit(f"The file '{manifest_filename}' could not be found, error: {errormessage}")
+    samples = []
+    with manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) == 1:
+                samples.append((sample_name(fields[0]), fields[0]))
+            elif len(fields) == 2:
+                samples.append((fields[0], fields[1]))
+            else:
+                sys.exit(f"The line '{line}' in {manifest_filename} needs to be a file, or a sample name and a file")
+    return samples
+
+def sample_name(read_filename):
+    '''Return the name of the sample in read_filename, the file name without the fastq extensions'''
+    name = os.path.basename(read_filename)
+    for extension in (".gz", ".txt", ".fastq", ".fq"):
+        if name.endswith(extension) and len(name) > len(extension):
+            name = name[:-len(extension)]
+    return name
+
+def _scan_sample_file(sample):
+    '''Scan one sample in a worker started with _init_worker, return the name,
+       the coverage stats of each gene and the stats of the scan
+    '''
+    name, read_filename = sample
+    stats = Stats(worker_stats)
+    TOTALgene2depht_count = worker_depht_counts()
+    read_batches = stats.timed_iter("fastq_parse", read_fastq_batches(read_filename))
+    # The exit of a worker is sent back in place of the stats, as in _scan_batch
+    try:
+        with stats.stage("read_scan"):
+            reads = (dna_read for dna_reads in read_batches for dna_read in dna_reads)
+            scan_reads(reads, worker_index, worker_kmer_length, TOTALgene2depht_count, stats)
+    except SystemExit as error:
+        return name, error, stats
+    with stats.stage("coverage_stats"):
+        gene2stats = TOTALgene2depht_count.coverage_stats()
+    return name, gene2stats, stats
+
+def scan_samples(samples, kmer2gene2kmerpos, kmer_length, use_numpy=False, threads=1, stats=NO_STATS):
+    '''Scan each of the samples [(name, fastq_filename)] against the same index,
+       return {name: gene2stats} with the (coverage, avg_depht, min_depht) of each gene.
+       With threads > 1 the samples are scanned by a pool of worker processes,
+       one sample per worker at a time, starting with the biggest files.
+    '''
+    for name, read_filename in samples:
+        if not os.path.exists(read_filename):
+            sys.exit(f"The file '{read_filename}' of sample {name} could not be found")
+    # Start the biggest samples first, so the last sample to finish is a small one
+    samples = sorted(samples, key=lambda sample: os.path.getsize(sample[1]), reverse=True)
+    initargs = (kmer2gene2kmerpos, kmer_length, NumpyDephtCounts if use_numpy else DephtCounts, stats.enabled)
+
+    sample2stats = dict()
+    if threads > 1:
+        with multiprocessing.Pool(min(threads, len(samples)), initializer=_init_worker, initargs=initargs) as pool:
+            for name, gene2stats, sample_stats in pool.imap_unordered(_scan_sample_file, samples):
+                if isinstance(gene2stats, SystemExit):
+                    sys.exit(gene2stats.code)
+                sample2stats[name] = gene2stats
+                stats.merge(sample_stats)
+    else:
+        _init_worker(*initargs)
+        for sample in samples:
+            name, gene2stats, sample_stats = _scan_sample_file(sample)
+            if isinstance(gene2stats, SystemExit):
+                sys.exit(gene2stats.code)
+            sample2stats[name] = gene2stats
+            stats.merge(sample_stats)
+    return sample2stats
+
+def format_matrix(sample2stats, sample_names, min_coverage=0.95, min_depht=10):
+    '''Format a tab seperated gene x sample matrix with the coverage and avg depht of each
+       gene in each sample. The rows are the genes called in at least one of the samples,
+       sorted by how many samples they are called in, then by name.
+    '''
+    gene2called = dict()
+    for name in sample_names:
+        for genename, (coverage, avg_depht, min_depht_gene) in sample2stats[name].items():
+            if coverage > min_coverage and min_depht_gene > min_depht:
+                gene2called[genename] = gene2called.get(genename, 0) + 1
+
+    header = ["gene", "resistence"]
+    for name in sample_names:
+        header += [f"{name}_coverage", f"{name}_avg_depht"]
+    lines = ["\t".join(header)]
+    for genename in sorted(gene2called, key=lambda genename: (-gene2called[genename], genename)):
+        row = list(split_genename(genename))
+        for name in sample_names:
+            (coverage, avg_depht, _) = sample2stats[name].get(genename, (0, 0, 0))
+            row += [str(round(coverage,2)), str(round(avg_depht,2))]
+        lines.append("\t".join(row))
+    return "\n".join(lines) + "\n"
+
+def write_sample_tsvs(sample2stats, outdir, min_coverage=0.95, min_depht=10):
+    '''Write the called genes of each sample to outdir/<sample>.tsv'''
+    os.makedirs(outdir, exist_ok=True)
+    for name, gene2stats in sample2stats.items():
+        with open(os.path.join(outdir, f"{name}.tsv"), "w") as file:
+            file.write(format_tsv(select_genes(gene2stats, min_coverage, min_depht)))
+
+class ScanHandler(socketserver.StreamRequestHandler):
+    '''Handles one scan job sent to the ScanServer.
+       The job is one line of JSON: {"reads": fastq_filename, "format": "tsv" or "json",
+       "min_coverage": 0.95, "min_depht": 10, "threads": 1}, where only "reads" is needed.
+       If "reads" is "-" the reads follow the line on the connection, as fastq or fasta,
+       gzip, bgzip, bz2 or xz compressed or not.
+       The answer is one JSON object with the called "genes" (and the "tsv" output if asked for),
+       or with an "error".
+    '''
+    def handle(self):
+        try:
+            job = json.loads(self.rfile.readline())
+            # A number would be opened as a file descriptor of the server
+            if not isinstance(job["reads"], str):
+                raise TypeError(f"\"reads\" must be a file name, not {job['reads']!r}")
+            if job["reads"] == "-":
+                read_batches = read_fastq_batches("<stream>", fileobj=self.rfile)
+            else:
+                read_batches = read_fastq_batches(job["reads"])
+            TOTALgene2depht_count = scan_sample(read_batches, self.server.kmer2gene2kmerpos, self.server.kmer_length,
+                                                self.server.use_numpy, job.get("threads", 1))
+            genes = called_genes(TOTALgene2depht_count, job.get("min_coverage", 0.95), job.get("min_depht", 10))
+            answer = {"genes": [dict(zip(("gene", "resistence", "coverage", "avg_depht"), gene)) for gene in genes]}
+            if job.get("format", "tsv") == "tsv":
+                answer["tsv"] = format_tsv(genes)
+        # The readers exit with a message on bad files, which is sent back instead
+        except SystemExit as error:
+            answer = {"error": str(error.code)}
+        except (ValueError, KeyError, TypeError) as error:
+            answer = {"error": f"Bad scan job: {error!r}"}
+        # Any other error (eg the reads are a directory) is answered too, so the client is never left without one
+        except Exception as error:
+            print(f"The scan job failed, error: {error!r}", file=sys.stderr)
+            answer = {"error": f"The scan failed, error: {error!r}"}
+        self.wfile.write(json.dumps(answer).encode("utf-8") + b"\n")
+
+class ScanServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    '''Serves scan jobs over a unix domain socket against one index kept in memory.
+       Each job is scanned in a forked process, so several jobs run at once
+       and share the index with the server.
+    '''
+    def __init__(self, socket_path, kmer2gene2kmerpos, kmer_length, use_numpy=False):
+        self.kmer2gene2kmerpos = kmer2gene2kmerpos
+        self.kmer_length = kmer_length
+        self.use_numpy = use_numpy
+        # Remove the socket of an earlier server
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, ScanHandler)
+
+def serve(socket_path, kmer2gene2kmerpos, kmer_length, use_numpy=False):
+    '''Serve scan jobs on the socket untill interrupted'''
+    with ScanServer(socket_path, kmer2gene2kmerpos, kmer_length, use_numpy) as server:
+        print(f"Serving scan jobs on {socket_path}", file=sys.stderr)
+        # Stop the same way on kill as on ctrl-c, so the socket is removed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
+
+def request_scan(socket_path, job, stream=None):
+    '''Send a scan job to a ScanServer and return its answer.
+       If stream is given (a binary file with reads in any format read_fastq_batches reads) it is sent after the job,
+       and job["reads"] should be "-".
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+        except OSError as errormessage:
+            sys.exit(f"Could not connect to '{socket_path}', error: {errormessage}")
+        connection.sendall(json.dumps(job).encode("utf-8") + b"\n")
+        if stream is not None:
+            for block in iter(lambda: stream.read(FASTQ_BLOCK_SIZE), b""):
+                connection.sendall(block)
+        connection.shutdown(socket.SHUT_WR)
+        with connection.makefile("rb") as answer_file:
+            answer = answer_file.read()
+    # The server sends no answer if the process of the job was killed
+    if not answer.strip():
+        sys.exit(f"The server on '{socket_path}' closed the connection without an answer")
+    try:
+        return json.loads(answer)
+    except ValueError as errormessage:
+        sys.exit(f"The server on '{socket_path}' sent an answer which is not JSON, error: {errormessage}")
+
+def report_main(argv):
+    '''The report subcommand: GenesInRead.py report PROFILE [--min-coverage C] [--min-depht D] [--sort ORDER] [--json] [--gene GENE]
+       Output the called genes of a depht profile (eg from --depht-out) with new criteria, without
+       scanning the reads again. The stats of the genes are stored in the profile, so only --gene
+       (output the depht of each position of the gene) reads the dephts.
+    '''
+    options = argument_parser(argv, {
+        "--min-coverage": 0.95,
+        "--min-depht": 10,
+        "--sort": "coverage",
+        "--gene": None},
+        flags=["--json"],
+        positional="profiles")
+    if len(options["profiles"]) != 1:
+        sys.exit("Give one depht profile to report on: GenesInRead.py report PROFILE")
+    if options["--sort"] not in SORT_ORDERS:
+        sys.exit(f"--sort needs to be one of: {', '.join(SORT_ORDERS)}")
+    profile = DephtProfile(options["profiles"][0])
+
+    # With --gene the dephts of the genes with that name (or fasta header) are output
+    if options["--gene"] is not None:
+        found = False
+        for i, genename in enumerate(profile.genenames):
+            if options["--gene"] in (genename[1:], split_genename(genename)[0]):
+                found = True
+                print(f"# {genename[1:]}")
+                print("position\tdepht")
+                print("".join(f"{position}\t{depht}\n" for position, depht in enumerate(profile.depht_count(i))), end="")
+        if not found:
+            sys.exit(f"The gene '{options['--gene']}' is not in the depht profile")
+        return
+
+    genes = select_genes(profile.coverage_stats(), options["--min-coverage"], options["--min-depht"], options["--sort"])
+    if options["--json"]:
+        print(json.dumps([dict(zip(("gene", "resistence", "coverage", "avg_depht"), gene)) for gene in genes], indent=2))
+    else:
+        print(format_tsv(genes), end="")
+
+def merge_main(argv):
+    '''The merge subcommand: GenesInRead.py merge PROFILE... [-o MERGED] [--min-coverage C] [--min-depht D] [--json]
+       Add up the depht profiles of scans of parts of the same sample (eg from --checkpoint on
+       different nodes) and output the called genes, and save the merged profile with -o.
+    '''
+    options = argument_parser(argv, {
+        "-o": None,
+        "--min-coverage": 0.95,
+        "--min-depht": 10},
+        flags=["--numpy", "--json"],
+        positional="profiles")
+    if not options["profiles"]:
+        sys.exit("Give the depht profiles to merge: GenesInRead.py merge PROFILE...")
+
+    TOTALgene2depht_count = NumpyDephtCounts() if options["--numpy"] else DephtCounts()
+    merged = None
+    for profile_filename in options["profiles"]:
+        metadata = read_depht_profile(profile_filename, TOTALgene2depht_count)
+        if merged is None:
+            merged = dict(metadata, read_files=[], reads_done=0, complete=True)
+        # Only profiles made with the same genes and kmer length can be added up
+        elif (metadata["kmer_length"], metadata["gene_digest"]) != (merged["kmer_length"], merged["gene_digest"]):
+            sys.exit(f"The depht profile '{profile_filename}' was made with another gene file or kmer length")
+        if not metadata["complete"]:
+            print(f"The depht profile '{profile_filename}' is of an unfinished scan", file=sys.stderr)
+        merged["read_files"] += metadata["read_files"]
+        merged["reads_done"] += metadata["reads_done"]
+        merged["complete"] = merged["complete"] and metadata["complete"]
+    if options["-o"] is not None:
+        write_depht_profile(options["-o"], TOTALgene2depht_count, merged)
+
+    genes = called_genes(TOTALgene2depht_count, options["--min-coverage"], options["--min-depht"])
+    if options["--json"]:
+        print(json.dumps([dict(zip(("gene", "resistence", "coverage", "avg_depht"), gene)) for gene in genes], indent=2))
+    else:
+        print(format_tsv(genes), end="")
+
+def main(argv):
+    # The merge subcommand adds up depht profiles
+    if len(argv) > 1 and argv[1] == "merge":
+        return merge_main(argv[2:])
+    # The report subcommand outputs the called genes of a depht profile
+    if len(argv) > 1 and argv[1] == "report":
+        return report_main(argv[2:])
+
+    # Setting up the argument parser
+    options = argument_parser(argv, {
+        "-k": 19,
+        "-g": "resistance_genes.fsa",
+        "-r": "Unknown3_raw_reads_1.txt.gz",
+        "--index": None,
+        "--build-index": None,
+        "-t": 1,
+        "--minimizer": 0,
+        "--stats-json": None,
+        "--profile": None,
+        "--min-coverage": 0.95,
+        "--min-depht": 10,
+        "--serve": None,
+        "--connect": None,
+        "--manifest": None,
+        "--outdir": None,
+        "--matrix": None,
+        "-r1": None,
+        "-r2": None,
+        "--converge": 0,
+        "--stable": 3,
+        "--margin": 0.0,
+        "--bloom": 0,
+        "--checkpoint": None,
+        "--every": 1000000,
+        "--depht-out": None},
+        flags=["--numpy", "--stats", "--json", "--stream", "--fragment", "--csr", "--resume", "--trace-memory"],
+        aliases={"--threads": "-t"},
+        multi=["-r"])
+    (kmer_length, gene_filename) = (options["-k"], options["-g"])
+
+    # The kmers are packed 2 bits per base, and in 64 bit integers in an index file or with --csr
+    if kmer_length < 1:
+        sys.exit("The kmer length (-k) needs to be at least 1")
+    if kmer_length > 32 and (options["--csr"] or options["--index"] is not None or options["--build-index"] is not None):
+        sys.exit("The kmer length (-k) can be at most 32 with --csr, --index or --build-index")
+
+    # Several fastq files can be given with -r, or listed in a --manifest file
+    samples = [(sample_name(read_filename), read_filename) for read_filename in options["-r"]]
+    if options["--manifest"] is not None:
+        samples = read_manifest(options["--manifest"]) + (samples if "-r" in argv else [])
+    if len(set(name for name, _ in samples)) < len(samples):
+        sys.exit("The samples needs to have different names: " + ", ".join(name for name, _ in samples))
+    batch_mode = len(samples) > 1 or options["--manifest"] is not None
+    if batch_mode and any(read_filename == "-" for _, read_filename in samples):
+        sys.exit("stdin (-r -) can only be read as a single sample")
+    read_filename = samples[0][1] if samples else None
+
+    # A paired-end sample is given with -r1 and -r2
+    paired = options["-r1"] is not None or options["-r2"] is not None
+    if paired:
+        if options["-r1"] is None or options["-r2"] is None:
+            sys.exit("Both mates of a paired-end sample needs to be given with -r1 and -r2")
+        if batch_mode or "-r" in argv or options["--connect"] is not None:
+            sys.exit("A paired-end sample given with -r1 and -r2 can not be scanned with -r, --manifest or --connect")
+    elif options["--fragment"]:
+        sys.exit("--fragment needs a paired-end sample given with -r1 and -r2")
+
+    # With --converge N the called genes are found every N reads, and the scan stops when they are stable
+    if options["--converge"] > 0 and (paired or batch_mode or options["-t"] > 1 or options["--connect"] is not None):
+        sys.exit("--converge scans one fastq file given with -r in one process")
+
+    # With --checkpoint FILE the depht counts are saved every --every reads, and --resume continues from the saved counts
+    if options["--checkpoint"] is not None:
+        if batch_mode or options["--converge"] > 0 or options["--connect"] is not None:
+            sys.exit("--checkpoint can not be used with several samples, --converge or --connect")
+        if options["--every"] < 1:
+            sys.exit("--every needs to be at least 1")
+    elif options["--resume"]:
+        sys.exit("--resume needs the --checkpoint file to resume from")
+
+    # With --depht-out FILE the depht of each position of the genes is saved, compressed, for the report subcommand
+    if options["--depht-out"] is not None and (batch_mode or options["--connect"] is not None):
+        sys.exit("--depht-out can not be used with several samples or --connect")
+
+    # With --connect SOCKET the scan job is sent to a server started with --serve SOCKET
+    if options["--connect"] is not None:
+        if batch_mode:
+            sys.exit("Only one fastq file can be scanned with --connect")
+        job = {"reads": os.path.abspath(read_filename), "format": "json" if options["--json"] else "tsv",
+               "min_coverage": options["--min-coverage"], "min_depht": options["--min-depht"],
+               "threads": options["-t"]}
+        # With --stream the reads are sent over the socket instead of read by the server
+        if read_filename == "-":
+            job["reads"] = "-"
+            answer = request_scan(options["--connect"], job, sys.stdin.buffer)
+        elif options["--stream"]:
+            job["reads"] = "-"
+            try: stream = open(read_filename, "rb")
+            except FileNotFoundError as errormessage:
+                sys.exit(f"The file '{read_filename}' could not be found, error: {errormessage}")
+            with stream:
+                answer = request_scan(options["--connect"], job, stream)
+        else:
+            answer = request_scan(options["--connect"], job)
+        if "error" in answer:
+            sys.exit(answer["error"])
+        print(answer["tsv"] if "tsv" in answer else json.dumps(answer["genes"], indent=2), end="" if "tsv" in answer else "\n")
+        return
+
+    # With --stats or --stats-json the time of each stage, counters and the peak memory (rss) are reported.
+    # With --trace-memory the peak memory allocated by python is traced too, which slows down the run many times.
+    # With --profile and -t N the workers profile their scans as well, and the profiles are added up.
+    stats = Stats(options["--stats"] or options["--stats-json"] is not None or options["--trace-memory"],
+                  profile_workers=options["--profile"] is not None and options["-t"] > 1)
+    if options["--trace-memory"]:
+        tracemalloc.start()
+
+    # Only build the index and save it to a file
+    if options["--build-index"] is not None:
+        write_index(options["--build-index"], build_index(gene_filename, kmer_length, threads=options["-t"]),
+                    kmer_length, gene_file_digest(gene_filename))
+        sys.exit()
+
+    # Use a prebuilt index if given, else build kmer2gene2kmerpos from the gene file.
+    # A prebuilt index still makes a dict of its kmers for the lookups, --index --csr
+    # instead looks the kmers up in the mapped file with numpy, without the dict.
+    # With --minimizer W only the (W, k) minimizers of the genes are indexed.
+    kmer2gene2kmerpos = select_index(options, stats)
+
+    # With --serve SOCKET the index is kept in memory and scan jobs are served on the socket
+    if options["--serve"] is not None:
+        serve(options["--serve"], kmer2gene2kmerpos, kmer_length, options["--numpy"])
+        return
+
+    # With several samples the index is used for all of them, and the samples are scanned in parallel.
+    # A gene x sample matrix is output, and with --outdir DIR the called genes of each sample are written to DIR/<sample>.tsv
+    if batch_mode:
+        if not samples:
+            sys.exit(f"No samples found in {options['--manifest']}")
+        sample2stats = scan_samples(samples, kmer2gene2kmerpos, kmer_length, options["--numpy"], options["-t"], stats)
+        if options["--outdir"] is not None:
+            write_sample_tsvs(sample2stats, options["--outdir"], options["--min-coverage"], options["--min-depht"])
+        matrix = format_matrix(sample2stats, [name for name, _ in samples],
+                               options["--min-coverage"], options["--min-depht"])
+        if options["--matrix"] is None:
+            print(matrix, end="")
+        else:
+            with open(options["--matrix"], "w") as file:
+                file.write(matrix)
+        if stats.enabled:
+            write_stats(stats, kmer2gene2kmerpos, options["--stats-json"])
+        return
+
+    # Read in the fastaq file, for each read evaluate if read is valid.
+    # If valid, add it to total depht count for each gene saved in TOTALgene2depht_count
+    # With --profile the read scan is profiled with cProfile and the profile saved to a file
+    profile = cProfile.Profile() if options["--profile"] is not None else None
+    if profile is not None:
+        profile.enable()
+    # The mates of a paired-end sample are read at the same time and counted together.
+    # With --fragment the coverage is evaluated for each fragment instead of each mate.
+    fraction_read = None
+    read_files = [options["-r1"], options["-r2"]] if paired else [read_filename]
+    metadata = {"kmer_length": kmer_length, "gene_digest": gene_file_digest(gene_filename).hex(),
+                "read_files": [filename if filename == "-" else os.path.abspath(filename) for filename in read_files],
+                "fragment": options["--fragment"], "reads_done": 0, "complete": False}
+    if options["--converge"] > 0:
+        TOTALgene2depht_count = NumpyDephtCounts() if options["--numpy"] else DephtCounts()
+        (n_reads, fraction_read) = scan_until_converged(read_filename, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count,
+                                                        options["--converge"], options["--stable"], options["--margin"],
+                                                        options["--min-coverage"], options["--min-depht"], stats)
+        if fraction_read is None:
+            print(f"Scanned {n_reads} reads of '{read_filename}'", file=sys.stderr)
+        else:
+            print(f"Scanned {n_reads} reads, about {round(100 * fraction_read, 1)}% of '{read_filename}'", file=sys.stderr)
+        metadata["reads_done"] = n_reads
+    elif options["--checkpoint"] is not None:
+        TOTALgene2depht_count = NumpyDephtCounts() if options["--numpy"] else DephtCounts()
+        if options["--resume"] and os.path.exists(options["--checkpoint"]):
+            if "-" in read_files:
+                sys.exit("A scan of stdin can not be resumed")
+            saved = read_depht_profile(options["--checkpoint"], TOTALgene2depht_count)
+            for key in ("kmer_length", "gene_digest", "read_files", "fragment"):
+                if saved.get(key) != metadata[key]:
+                    sys.exit(f"The checkpoint '{options['--checkpoint']}' is of another scan, its {key} differs")
+            metadata.update(reads_done=saved["reads_done"], complete=saved["complete"])
+            print(f"Resuming after {saved['reads_done']} reads", file=sys.stderr)
+        if not metadata["complete"]:
+            if options["--fragment"]:
+                (read_batches, scan) = (paired_batches(options["-r1"], options["-r2"]), scan_fragments)
+            else:
+                (read_batches, scan) = (mate_batches(options["-r1"], options["-r2"]) if paired else read_fastq_batches(read_filename), scan_reads)
+            scan_with_checkpoints(read_batches, kmer2gene2kmerpos, kmer_length, TOTALgene2depht_count, options["--checkpoint"],
+                                  options["--every"], metadata, options["-t"], stats, scan)
+    elif options["--fragment"]:
+        TOTALgene2depht_count = scan_sample(counted_batches(paired_batches(options["-r1"], options["-r2"]), metadata),
+                                            kmer2gene2kmerpos, kmer_length, options["--numpy"], options["-t"], stats, scan_fragments)
+        metadata["complete"] = True
+    else:
+        read_batches = mate_batches(options["-r1"], options["-r2"]) if paired else read_fastq_batches(read_filename)
+        TOTALgene2depht_count = scan_sample(counted_batches(read_batches, metadata), kmer2gene2kmerpos, kmer_length,
+                                            options["--numpy"], options["-t"], stats)
+        metadata["complete"] = True
+    if profile is not None:
+        profile.disable()
+        # The profiles of the scans in the worker processes are added to the profile of the main process
+        profile_stats = pstats.Stats(profile)
+        for worker_profile_data in stats.worker_profiles:
+            worker_profile_stats = pstats.Stats()
+            worker_profile_stats.stats = worker_profile_data
+            profile_stats.add(worker_profile_stats)
+        profile_stats.dump_stats(options["--profile"])
+    if options["--depht-out"] is not None:
+        with stats.stage("depht_out"):
+            write_depht_profile(options["--depht-out"], TOTALgene2depht_count, metadata, compress=True)
+
+    # output the genes with enough coverage and depht in tab seperated format
+    genes = called_genes(TOTALgene2depht_count, options["--min-coverage"], options["--min-depht"], stats)
+    if options["--json"]:
+        rows = [dict(zip(("gene", "resistence", "coverage", "avg_depht"), gene)) for gene in genes]
+        if fraction_read is not None:
+            for row in rows:
+                row["extrapolated_avg_depht"] = round(row["avg_depht"] / fraction_read, 2)
+        print(json.dumps(rows, indent=2))
+    else:
+        print(format_tsv(genes, fraction_read), end="")
+
+    if stats.enabled:
+        write_stats(stats, kmer2gene2kmerpos, options["--stats-json"])
+
+if __name__ == "__main__":
+    main(sys.argv)
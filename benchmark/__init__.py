@@ -0,0 +1,10 @@
+'''Benchmarks of GenesInRead.py
+
+simulate.py writes deterministic gzipped fastq files with reads sampled from
+the resistance genes, bench.py times the parts of GenesInRead.py and whole
+runs on such files and reports the results as JSON.
+
+Run from the directory of GenesInRead.py:
+    python -m benchmark.simulate -g resistance_genes.fsa -o reads.fq.gz -n 1000000
+    python -m benchmark -g resistance_genes.fsa -n 1000000,10000000 -o bench.json
+'''
@@ -0,0 +1,4 @@
+import sys
+from benchmark.bench import main
+
+main(sys.argv)
@@ -0,0 +1,206 @@
+#! /usr/bin/env python
+'''Micro benchmarks of the parts of GenesInRead.py and end to end runs on
+simulated reads. The results are written as JSON, so they can be compared
+between releases.
+'''
+import os
+import sys
+import json
+import time
+import random
+import platform
+import resource
+import tempfile
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+from GenesInRead import (argument_parser, read_fasta, read_fastq, read_fastq_batches, encode_canonical_kmers,
+                         batch_canonical_kmers, build_index, load_index, select_index, merge_intervals, read_is_valid,
+                         scan_reads, scan_sample, DephtCounts, CSR_BATCH_SIZE, np)
+from benchmark.simulate import simulate_reads, write_fastq
+
+def timed(function, repeat=3):
+    '''Return the best wall time of repeat calls of function() and the result of the last call'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best, result
+
+def peak_rss():
+    '''Return the peak resident memory of this process in bytes'''
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+def rates(seconds, n_reads, n_bases):
+    return {"seconds": seconds,
+            "reads_per_sec": n_reads / seconds if seconds else None,
+            "bases_per_sec": n_bases / seconds if seconds else None}
+
+def simulated_file(directory, gene_filename, n_reads, seed=1):
+    '''Return the name of a gzipped fastq file with n_reads simulated reads,
+       writing it only if it is not already in directory
+    '''
+    filename = os.path.join(directory, f"simulated_{n_reads}_{seed}.fq.gz")
+    if not os.path.exists(filename):
+        write_fastq(filename, simulate_reads(list(read_fasta(gene_filename)), n_reads, seed=seed))
+    return filename
+
+def validity_cases(genes, n_cases, seed=1):
+    '''Return n_cases deterministic (intervals, length_gene, read) for read_is_valid,
+       looking like the kmer hits of 100 bp reads with an occasional gap
+    '''
+    rng = random.Random(seed)
+    read = "A" * 100
+    cases = []
+    for _ in range(n_cases):
+        len_gene = len(rng.choice(genes)[0])
+        start = rng.randrange(-50, len_gene - 50)
+        hits = [(max(0, start), min(len_gene, start + 100))]
+        if rng.random() < 0.3:
+            gap = rng.randrange(hits[0][0], hits[0][1])
+            hits = [(hits[0][0], gap), (min(gap + 1, hits[0][1]), hits[0][1])]
+        cases.append((merge_intervals(hits), len_gene, read))
+    return cases
+
+def micro_benchmarks(gene_filename, read_filename, kmer_length):
+    '''Time read_fasta, read_fastq, encode_canonical_kmers (and batch_canonical_kmers if numpy
+       is installed), the index build, read_is_valid and coverage_stats on their own
+    '''
+    results = dict()
+
+    seconds, genes = timed(lambda: list(read_fasta(gene_filename)))
+    n_bases = sum(len(dna) for dna, _ in genes)
+    results["read_fasta"] = {"seconds": seconds, "genes_per_sec": len(genes) / seconds,
+                             "bases_per_sec": n_bases / seconds}
+
+    seconds, reads = timed(lambda: list(read_fastq(read_filename)))
+    n_bases = sum(len(dna) for dna in reads)
+    results["read_fastq"] = rates(seconds, len(reads), n_bases)
+
+    seconds, _ = timed(lambda: [list(encode_canonical_kmers(dna, kmer_length)) for dna in reads])
+    results["encode_canonical_kmers"] = rates(seconds, len(reads), n_bases)
+
+    # The sorted array index encodes the reads CSR_BATCH_SIZE at a time
+    if np is not None:
+        batches = [reads[i: i + CSR_BATCH_SIZE] for i in range(0, len(reads), CSR_BATCH_SIZE)]
+        seconds, _ = timed(lambda: [batch_canonical_kmers(batch, kmer_length) for batch in batches])
+        results["batch_canonical_kmers"] = rates(seconds, len(reads), n_bases)
+
+    seconds, index = timed(lambda: build_index(gene_filename, kmer_length), repeat=1)
+    results["build_index"] = {"seconds": seconds, "kmers": len(index)}
+
+    cases = validity_cases(genes, 100000)
+    seconds, _ = timed(lambda: [read_is_valid(*case) for case in cases])
+    results["read_is_valid"] = {"seconds": seconds, "calls_per_sec": len(cases) / seconds}
+
+    TOTALgene2depht_count = scan_reads(reads, index, kmer_length, DephtCounts())
+    n_positions = sum(map(len, TOTALgene2depht_count.gene2depht_count.values()))
+    seconds, _ = timed(TOTALgene2depht_count.coverage_stats)
+    results["coverage_stats"] = {"seconds": seconds, "genes": len(TOTALgene2depht_count.gene2depht_count),
+                                 "positions_per_sec": n_positions / seconds if seconds else None}
+    return results
+
+def end_to_end(gene_filename, read_filename, kmer_length, scan="default", threads=2, index_filename=None):
+    '''Run GenesInRead on a file the way main does, with the index and scan of scan:
+       "default", "csr" (the sorted array index), "threads" (threads worker processes)
+       or "mapped" (the prebuilt index file index_filename).
+       Return the index build (or load) time, the scan rates, the peak memory and how much the
+       peak memory of this process grew during the scan. Run in a new process to get its own peak memory.
+    '''
+    options = {"-g": gene_filename, "-k": kmer_length, "-t": threads, "--minimizer": 0, "--bloom": 0,
+               "--csr": scan == "csr", "--index": index_filename if scan == "mapped" else None}
+    start = time.perf_counter()
+    index = select_index(options)
+    build_seconds = time.perf_counter() - start
+
+    # Count the reads and bases while they are scanned
+    counts = [0, 0]
+    def counted_batches():
+        for dna_reads in read_fastq_batches(read_filename):
+            counts[0] += len(dna_reads)
+            counts[1] += sum(map(len, dna_reads))
+            yield dna_reads
+
+    rss_before_scan = peak_rss()
+    start = time.perf_counter()
+    TOTALgene2depht_count = scan_sample(counted_batches(), index, kmer_length, threads=threads if scan == "threads" else 1)
+    TOTALgene2depht_count.coverage_stats()
+    scan_seconds = time.perf_counter() - start
+
+    result = {"scan": scan, "threads": threads if scan == "threads" else 1, "index_build_seconds": build_seconds}
+    result.update(rates(scan_seconds, counts[0], counts[1]))
+    result.update({"reads": counts[0], "bases": counts[1], "peak_rss_bytes": peak_rss(),
+                   "scan_rss_bytes": peak_rss() - rss_before_scan})
+    return result
+
+def main(argv):
+    options = argument_parser(argv, {
+        "-g": "resistance_genes.fsa",
+        "-k": 19,
+        "-n": "1000000,10000000",
+        "-t": 2,
+        "--micro": 100000,
+        "--tmpdir": None,
+        "--max-scan-mb": 512,
+        "-o": None})
+    try:
+        sizes = [int(size) for size in options["-n"].split(",") if size]
+    except ValueError as e:
+        sys.exit(f"The read counts in -n needs to be integers, error:\n{e}")
+
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "kmer_length": options["-k"],
+              "gene_file": options["-g"]}
+
+    # The simulated files are kept in --tmpdir for the next run, else they are removed at the end
+    if options["--tmpdir"] is not None:
+        os.makedirs(options["--tmpdir"], exist_ok=True)
+        directory = nullcontext(options["--tmpdir"])
+    else:
+        directory = tempfile.TemporaryDirectory(prefix="genesinread_bench_")
+    with directory as directory:
+        if options["--micro"] > 0:
+            read_filename = simulated_file(directory, options["-g"], options["--micro"])
+            report["micro"] = micro_benchmarks(options["-g"], read_filename, options["-k"])
+
+        # The prebuilt index file is written once, the mapped runs only load it
+        index_filename = os.path.join(directory, f"index_{options['-k']}.gir")
+        load_index(index_filename, options["-g"], options["-k"])
+
+        # Each end to end run gets a fresh process, so the peak memory is its own.
+        # The sorted array index (--csr) is run too if numpy is installed.
+        report["end_to_end"] = []
+        scans = ["default", "threads", "mapped"] + (["csr"] if np is not None else [])
+        # The process is not a daemon like those of a multiprocessing.Pool, so the threads run can start its workers
+        context = multiprocessing.get_context("spawn")
+        for n_reads in sizes:
+            read_filename = simulated_file(directory, options["-g"], n_reads)
+            for scan in scans:
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    report["end_to_end"].append(executor.submit(end_to_end, options["-g"], read_filename, options["-k"], scan,
+                                                                options["-t"], index_filename).result())
+
+    output = json.dumps(report, indent=2)
+    if options["-o"] is None:
+        print(output)
+    else:
+        with open(options["-o"], "w") as file:
+            file.write(output + "\n")
+
+    # The memory of a scan should not grow with the number of reads or the size of the gene families
+    too_big = [f"{run['scan']} scan of {run['reads']} reads: {run['scan_rss_bytes'] >> 20} MB"
+               for run in report["end_to_end"] if run["scan_rss_bytes"] > options["--max-scan-mb"] << 20]
+    if too_big:
+        sys.exit(f"The peak memory grew by more than --max-scan-mb {options['--max-scan-mb']} MB during the scan in:\n"
+                 + "\n".join(too_big))
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+'''Regression checks of the sparse index modes of GenesInRead.py on simulated reads.
+The depht of each position of the genes is compared with the scan against the full
+kmer index, and the check exits with an error if they differ.
+'''
+import sys
+
+from GenesInRead import (argument_parser, read_fasta, build_index, build_minimizer_index,
+                         max_minimizer_window, scan_reads, DephtCounts)
+from benchmark.simulate import simulate_reads
+
+def differing_genes(TOTALgene2depht_count, EXPECTEDgene2depht_count):
+    '''Return the names of the genes with another depht count in TOTALgene2depht_count'''
+    (total, expected) = (TOTALgene2depht_count.gene2depht_count, EXPECTEDgene2depht_count.gene2depht_count)
+    return sorted(genename for genename in total.keys() | expected.keys() if total.get(genename) != expected.get(genename))
+
+def minimizer_check(gene_filename, reads, kmer_length):
+    '''Scan the reads (all of one length) with minimizer indexes of the windows up to the largest
+       allowed for the read length, and with the next larger window which must be refused.
+       Return a list of the failures, empty if the dephts are the same as with the full index.
+    '''
+    expected = scan_reads(reads, build_index(gene_filename, kmer_length), kmer_length, DephtCounts())
+    index = build_minimizer_index(gene_filename, kmer_length, 1)
+    max_window = max_minimizer_window(len(reads[0]), kmer_length, index.min_gene_length)
+
+    failures = []
+    for window in sorted({1, max_window // 2, max_window} - {0}):
+        index = build_minimizer_index(gene_filename, kmer_length, window)
+        genes = differing_genes(scan_reads(reads, index, kmer_length, DephtCounts()), expected)
+        print(f"--minimizer {window}: {len(genes)} genes differ from the full index", file=sys.stderr)
+        if genes:
+            failures.append(f"--minimizer {window} changes the depht of {len(genes)} genes, eg {genes[0]}")
+
+    # A larger window could miss valid reads, and must be refused
+    index = build_minimizer_index(gene_filename, kmer_length, max_window + 1)
+    try:
+        scan_reads(reads, index, kmer_length, DephtCounts())
+        failures.append(f"--minimizer {max_window + 1} was not refused for reads of {len(reads[0])} bases")
+    except SystemExit:
+        pass
+    return failures
+
+def main(argv):
+    options = argument_parser(argv, {
+        "-g": "resistance_genes.fsa",
+        "-k": 19,
+        "-n": 5000,
+        "--error-rate": 0.01})
+    # Half of the reads are from the genes, and the errors split them near the gene ends
+    genes = list(read_fasta(options["-g"]))
+    reads = list(simulate_reads(genes, options["-n"], error_rate=options["--error-rate"], background=0.5, seed=5))
+    failures = minimizer_check(options["-g"], reads, options["-k"])
+    if failures:
+        sys.exit("\n".join(failures))
+    print("The minimizer scans have the same dephts as the full index", file=sys.stderr)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+'''Deterministic read simulator.
+Samples reads from the genes of a fasta file (eg resistance_genes.fsa) at a
+chosen depth and error rate, mixed with random background reads, and writes
+them as a gzipped fastq file.
+'''
+import io
+import sys
+import gzip
+import random
+
+from GenesInRead import argument_parser, read_fasta
+
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+
+def simulate_reads(genes, n_reads, read_length=100, depth=30, error_rate=0.001, background=0.9, seed=1):
+    '''Yield n_reads simulated reads (str) from genes, a list of (dna, header).
+       A background fraction of the reads are random dna, the rest are sampled
+       from randomly chosen genes with the given depth on either strand, with
+       error_rate of the bases substituted by another base.
+       Each gene is placed between random flanks, so reads also overhang the gene ends.
+       The same arguments always give the same reads.
+    '''
+    rng = random.Random(seed)
+    genes = [dna for dna, _ in genes]
+    if not genes and background < 1:
+        sys.exit("There are no genes to sample reads from")
+
+    # The gene reads are spread over as many genes as needed for the depth
+    rng.shuffle(genes)
+    (gene_number, reads_left) = (-1, 0)
+    for _ in range(n_reads):
+        if rng.random() < background:
+            yield "".join(rng.choices("ACGT", k=read_length))
+            continue
+
+        # Move on to the next gene when it has the wanted depth
+        if reads_left == 0:
+            gene_number = (gene_number + 1) % len(genes)
+            flanks = ["".join(rng.choices("ACGT", k=read_length - 1)) for _ in range(2)]
+            dna = flanks[0] + genes[gene_number] + flanks[1]
+            reads_left = max(1, round(depth * len(dna) / read_length))
+        reads_left -= 1
+
+        start = rng.randrange(len(dna) - read_length + 1)
+        read = list(dna[start: start + read_length])
+        for i in range(read_length):
+            if rng.random() < error_rate:
+                read[i] = rng.choice("ACGT".replace(read[i], ""))
+        read = "".join(read)
+        if rng.random() < 0.5:
+            read = read.translate(COMPLEMENT)[::-1]
+        yield read
+
+def write_fastq(filename, reads):
+    '''Write the reads to a gzipped fastq file and return the number of reads'''
+    n_reads = 0
+    # mtime=0 keeps the file the same for the same reads
+    with io.TextIOWrapper(gzip.GzipFile(filename, "wb", compresslevel=1, mtime=0)) as file:
+        for n_reads, read in enumerate(reads, 1):
+            file.write(f"@sim_{n_reads}\n{read}\n+\n{'I' * len(read)}\n")
+    return n_reads
+
+def main(argv):
+    options = argument_parser(argv, {
+        "-g": "resistance_genes.fsa",
+        "-o": "simulated_reads.fq.gz",
+        "-n": 1000000,
+        "-l": 100,
+        "--depth": 30,
+        "--error-rate": 0.001,
+        "--background": 0.9,
+        "--seed": 1})
+
+    reads = simulate_reads(list(read_fasta(options["-g"])), options["-n"], options["-l"],
+                           options["--depth"], options["--error-rate"], options["--background"], options["--seed"])
+    write_fastq(options["-o"], reads)
+
+if __name__ == "__main__":
+    main(sys.argv)